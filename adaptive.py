@@ -0,0 +1,167 @@
+import numpy as np
+
+from config import INF, ADAPTIVE_BASE_SIDE, ADAPTIVE_TOLERANCE, ADAPTIVE_BUDGET
+from mesh import Mesh, MeshCancelled, find_jumps, mesh_axes, quad_normals
+
+
+class AdaptiveMesh(Mesh):
+    # Nodes of a quadtree over the lattice of a uniform grid, kept as a single row.
+    # Leaves are cells of any size, given as the (n, 4) node indices of their corners,
+    # and a leaf side is split into edges wherever a smaller neighbour has a node on it.
+    def __init__(self, vertices, edges, quads):
+        self.vertices = vertices.reshape(1, -1, 3)
+        self.X, self.Y, self.Z = self.vertices.transpose(2, 0, 1)
+        self.edges = edges
+        self.joined = np.zeros(len(edges), dtype=bool)
+        self.joined[1:] = edges[1:, 0] == edges[:-1, 1]
+        self.quads = quads
+        self._faces = None
+        self.func_key = None
+        self.x_axis = self.y_axis = self.values = None
+        self.levels = []
+        self.evaluations = 0
+
+    @property
+    def faces(self):
+        if self._faces is None:
+            z = self.Z[0]
+            quads = self.quads[~np.isnan(z[self.quads]).any(axis=1)]
+            self._faces = quads, quad_normals(self.vertices[0][quads])
+        return self._faces
+
+
+class LatticeSamples:
+    # Values of func on nodes of the lattice of the axes, evaluated on first use
+    def __init__(self, func, x_axis, y_axis):
+        self.func = func
+        self.x_axis = x_axis
+        self.y_axis = y_axis
+        self.keys = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0)
+
+    def key(self, i, j):
+        return j * len(self.x_axis) + i
+
+    def get(self, i, j):
+        keys = self.key(i, j)
+        new = np.setdiff1d(keys, self.keys)
+        if len(new):
+            i_new, j_new = new % len(self.x_axis), new // len(self.x_axis)
+            x, y = self.x_axis[i_new], self.y_axis[j_new]
+            values = np.array(np.broadcast_to(self.func(x, y), x.shape), dtype=np.float64)
+            values[np.abs(values) > INF] = np.nan
+            positions = np.searchsorted(self.keys, new)
+            self.keys = np.insert(self.keys, positions, new)
+            self.values = np.insert(self.values, positions, values)
+        return self.values[np.searchsorted(self.keys, keys)]
+
+
+def build_adaptive_mesh(func, x_begin, x_end, y_begin, y_end, x_step, y_step, scale=1,
+                        cancelled=None, budget=ADAPTIVE_BUDGET):
+    # Samples the lattice of the uniform grid only where it is needed: the grid starts
+    # ADAPTIVE_BASE_SIDE cells a side, and the cells whose centre is furthest from the
+    # bilinear interpolation of their corners are split in four, until all of them are
+    # within ADAPTIVE_TOLERANCE of the range of z, are one lattice cell, or the budget
+    # of evaluations is spent
+    x_axis, y_axis = mesh_axes(x_begin, x_end, y_begin, y_end, x_step, y_step)
+    samples = LatticeSamples(func, x_axis, y_axis)
+    cols = np.unique(np.linspace(0, len(x_axis) - 1, ADAPTIVE_BASE_SIDE + 1).round().astype(np.int64))
+    rows = np.unique(np.linspace(0, len(y_axis) - 1, ADAPTIVE_BASE_SIDE + 1).round().astype(np.int64))
+    i0, j0 = np.meshgrid(cols[:-1], rows[:-1])
+    i1, j1 = np.meshgrid(cols[1:], rows[1:])
+    cells = np.stack((i0.ravel(), j0.ravel(), i1.ravel(), j1.ravel()), axis=-1)
+    errors = np.full(len(cells), np.nan)
+    while True:
+        if cancelled is not None and cancelled.is_set():
+            raise MeshCancelled
+        splittable = (cells[:, 2] - cells[:, 0] > 1) | (cells[:, 3] - cells[:, 1] > 1)
+        errors[~splittable] = 0
+        probe = np.isnan(errors)
+        if probe.any():
+            errors[probe] = cell_errors(samples, cells[probe])
+        finite = samples.values[~np.isnan(samples.values)]
+        tolerance = ADAPTIVE_TOLERANCE * (np.ptp(finite) if len(finite) else 0)
+        split = np.flatnonzero(errors > tolerance)
+        # A split takes at most four side nodes and the probes of four children
+        room = (budget - len(samples.keys)) // 8
+        if not len(split) or room <= 0:
+            break
+        split = split[np.argsort(-errors[split], kind='stable')[:room]]
+        kept = np.ones(len(cells), dtype=bool)
+        kept[split] = False
+        children = split_cells(cells[split])
+        samples.get(children[:, [0, 2, 0, 2]].ravel(), children[:, [1, 1, 3, 3]].ravel())
+        cells = np.concatenate((cells[kept], children))
+        errors = np.concatenate((errors[kept], np.full(len(children), np.nan)))
+    mesh = adaptive_mesh(samples, cells, scale)
+    mesh.evaluations = len(samples.keys)
+    return mesh
+
+
+def cell_errors(samples, cells):
+    # Distance of the function at the centre of every cell from the bilinear
+    # interpolation of its corners. Cells where it is defined only in part are
+    # refined towards the border first.
+    i0, j0, i1, j1 = cells.T
+    i, j = (i0 + i1) // 2, (j0 + j1) // 2
+    x, y = samples.x_axis, samples.y_axis
+    tx = (x[i] - x[i0]) / (x[i1] - x[i0])
+    ty = (y[j] - y[j0]) / (y[j1] - y[j0])
+    z = samples.get(np.concatenate((i0, i1, i0, i1, i)), np.concatenate((j0, j0, j1, j1, j))).reshape(5, -1)
+    interpolated = (z[0] * (1 - tx) + z[1] * tx) * (1 - ty) + (z[2] * (1 - tx) + z[3] * tx) * ty
+    errors = np.abs(z[4] - interpolated)
+    nan = np.isnan(z)
+    errors[nan.any(axis=0)] = np.inf
+    errors[nan.all(axis=0)] = 0
+    return errors
+
+
+def split_cells(cells):
+    # Cells one lattice cell wide or high are only split the other way
+    i0, j0, i1, j1 = cells.T
+    i = np.where(i1 - i0 > 1, (i0 + i1) // 2, i1)
+    j = np.where(j1 - j0 > 1, (j0 + j1) // 2, j1)
+    children = np.concatenate([np.stack(child, axis=-1) for child in (
+        (i0, j0, i, j), (i, j0, i1, j), (i0, j, i, j1), (i, j, i1, j1))])
+    return children[(children[:, 2] > children[:, 0]) & (children[:, 3] > children[:, 1])]
+
+
+def adaptive_mesh(samples, cells, scale):
+    # Leaf corners become the nodes, in lattice order, and leaf sides the edges
+    i0, j0, i1, j1 = cells.T
+    m, n = len(samples.x_axis), len(samples.y_axis)
+    keys = np.unique(samples.key(np.concatenate((i0, i1, i0, i1)), np.concatenate((j0, j0, j1, j1))))
+    i, j = keys % m, keys // m
+    z = samples.get(i, j)
+    vertices = np.stack((samples.x_axis[i], samples.y_axis[j], z), axis=-1) * scale
+    quads = np.stack([np.searchsorted(keys, samples.key(*corner)) for corner in (
+        (i0, j0), (i1, j0), (i1, j1), (i0, j1))], axis=-1).astype(np.int32)
+    # Columns are walked in the order of the transposed lattice
+    columns = np.argsort(i * n + j, kind='stable')
+    row_edges = side_edges(keys, z, np.concatenate((j0, j1)) * m + np.concatenate((i0, i0)),
+                           np.concatenate((j0, j1)) * m + np.concatenate((i1, i1)))
+    column_edges = side_edges((i * n + j)[columns], z[columns],
+                              np.concatenate((i0, i1)) * n + np.concatenate((j0, j0)),
+                              np.concatenate((i0, i1)) * n + np.concatenate((j1, j1)))
+    edges = np.concatenate((row_edges, columns[column_edges])).astype(np.int32)
+    return AdaptiveMesh(vertices, edges, quads)
+
+
+def side_edges(keys, z, starts, ends):
+    # Pairs of nodes next to each other in the sorted keys that lie on a common leaf
+    # side, the sides being given by the keys of their end nodes. Like on a grid, NaN
+    # nodes and jumps are skipped.
+    count = len(keys)
+    if count < 2:
+        return np.empty((0, 2), dtype=np.int64)
+    cover = (np.bincount(np.searchsorted(keys, starts), minlength=count) -
+             np.bincount(np.searchsorted(keys, ends), minlength=count))
+    covered = np.cumsum(cover)[:-1] > 0
+    # Jumps are found on the lines of nodes, broken wherever no side covers a pair
+    breaks = np.flatnonzero(~covered) + 1
+    line = np.insert(z, breaks, np.nan)
+    positions = np.arange(count - 1) + np.searchsorted(breaks, np.arange(count - 1), side='right')
+    jumps = find_jumps(line[None])[0][positions]
+    valid = covered & ~np.isnan(z[:-1]) & ~np.isnan(z[1:]) & ~jumps
+    pairs = np.flatnonzero(valid)
+    return np.stack((pairs, pairs + 1), axis=-1)
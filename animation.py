@@ -0,0 +1,80 @@
+from threading import Condition, Thread
+
+import numpy as np
+
+from config import ANIMATION_DEPTH, FPS
+from mesh import build_frame, mesh_axes
+
+
+class FrameRing:
+    # Frames of an animated chart are evaluated ahead on a background thread into a
+    # fixed number of preallocated slots, frame k being the function at t = k / FPS.
+    # The plotter takes the newest frame that is due, the older ones are dropped, and
+    # the thread always goes on from the frame due now, so it skips what it is late for.
+    def __init__(self, func, x_begin, x_end, y_begin, y_end, x_step, y_step, scale=1,
+                 frame=0, depth=ANIMATION_DEPTH):
+        self.func = func
+        self.scale = scale
+        self.axes = mesh_axes(x_begin, x_end, y_begin, y_end, x_step, y_step)
+        x_axis, y_axis = self.axes
+        self.vertices = np.empty((depth, len(y_axis), len(x_axis), 3))
+        self.vertices[..., 0] = x_axis * scale
+        self.vertices[..., 1] = y_axis[:, None] * scale
+        self.frames = [None] * depth
+        self.meshes = [None] * depth
+        self.shown = None
+        self.writing = None
+        self.due = frame
+        self.next_frame = frame
+        self.stopped = False
+        self.condition = Condition()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def take(self, frame):
+        # The newest frame evaluated up to the given one, or None if there is nothing new
+        with self.condition:
+            self.due = frame
+            ready = [slot for slot, done in enumerate(self.frames)
+                     if done is not None and done <= frame and slot != self.shown]
+            if not ready:
+                return None
+            slot = max(ready, key=self.frames.__getitem__)
+            for old, done in enumerate(self.frames):
+                if done is not None and done < self.frames[slot]:
+                    self.frames[old] = self.meshes[old] = None
+            self.shown = slot
+            self.condition.notify()
+            return self.meshes[slot]
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def _free_slot(self):
+        for slot, done in enumerate(self.frames):
+            if done is None and slot not in (self.shown, self.writing):
+                return slot
+        return None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and self._free_slot() is None:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                slot = self._free_slot()
+                frame = max(self.next_frame, self.due)
+                self.next_frame = frame + 1
+                self.writing = slot
+            try:
+                mesh = build_frame(self.func, self.vertices[slot], *self.axes, frame / FPS, self.scale)
+            except Exception as err:
+                print("Error:", err)
+                return
+            with self.condition:
+                self.frames[slot] = frame
+                self.meshes[slot] = mesh
+                self.writing = None
@@ -0,0 +1,131 @@
+import argparse
+import json
+import platform
+import sys
+import tracemalloc
+from time import perf_counter
+
+import numpy as np
+import pygame
+
+from config import DEFAULT_CHARTS, START_H_ANGLE, START_V_ANGLE
+from plotter import create_chart, init_headless
+
+RESOLUTIONS = (1, 2, 4)
+CAMERA_ANGLES = ((START_H_ANGLE, START_V_ANGLE), (0, 0), (1.2, 2.5))
+FRAMES = 20
+BENCH_SIZE = (900, 980)
+
+
+def measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func()
+        times.append(perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, min(times) * 1000, peak / 1024
+
+
+def bench_chart(screen, spec, resolution, angles, frames, adaptive=False):
+    func, x_from, x_to, y_from, y_to, x_step, y_step, scale = spec
+    mesh_params = (func, x_from, x_to, y_from, y_to, x_step / resolution, y_step / resolution, scale)
+    chart, make_ms, make_kib = measure(lambda: create_chart(*mesh_params, adaptive=adaptive), 5)
+    result = {
+        'chart': func,
+        'resolution': resolution,
+        'adaptive': adaptive,
+        'evaluations': getattr(chart.mesh, 'evaluations', chart.mesh.size),
+        'nodes': chart.mesh.size,
+        'segments': len(chart.mesh.edges),
+        'make_chart_ms': make_ms,
+        'make_chart_peak_kib': make_kib,
+        'views': []
+    }
+    width, height = screen.get_size()
+    chart.move(width // 2, 0, -height // 2)
+    for h_angle, v_angle in angles:
+        chart.rotate(h_angle, v_angle)
+
+        def render():
+            chart.dirty = True
+            chart.render(screen)
+
+        _, render_ms, render_kib = measure(render, frames)
+        result['views'].append({
+            'h_angle': h_angle,
+            'v_angle': v_angle,
+            'render_ms': render_ms,
+            'render_peak_kib': render_kib
+        })
+    return result
+
+
+def compare(results, baseline, tolerance):
+    # Returns the measurements that got slower than the baseline by more than tolerance
+    old = {(r['chart'], r['resolution'], r.get('adaptive', False)): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        reference = old.get((result['chart'], result['resolution'], result['adaptive']))
+        if reference is None:
+            continue
+        pairs = [('make_chart_ms', result['make_chart_ms'], reference['make_chart_ms'])]
+        pairs += [('render_ms', view['render_ms'], old_view['render_ms'])
+                  for view, old_view in zip(result['views'], reference['views'])]
+        for name, value, old_value in pairs:
+            if value > old_value * tolerance:
+                regressions.append((result['chart'], result['resolution'], name, old_value, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark meshing and rendering of the default charts')
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    parser.add_argument('-r', '--resolutions', type=float, nargs='+', default=RESOLUTIONS,
+                        help='step divisors applied to every default chart')
+    parser.add_argument('-f', '--frames', type=int, default=FRAMES)
+    parser.add_argument('-a', '--adaptive', action='store_true',
+                        help='sample the charts adaptively, the resolution setting the finest step')
+    parser.add_argument('-b', '--baseline', help='earlier results to check for regressions')
+    parser.add_argument('-t', '--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+
+    np.seterr(all='ignore')
+    screen = init_headless(BENCH_SIZE)
+    results = []
+    for spec in DEFAULT_CHARTS:
+        for resolution in args.resolutions:
+            result = bench_chart(screen, spec, resolution, CAMERA_ANGLES, args.frames, args.adaptive)
+            results.append(result)
+            render_ms = max(view['render_ms'] for view in result['views'])
+            print(f"{result['chart']:<45} x{resolution:<4g} {result['evaluations']:>8} evaluations "
+                  f"{result['nodes']:>8} nodes "
+                  f"{result['segments']:>8} segments  make_chart {result['make_chart_ms']:8.2f} ms  "
+                  f"render {render_ms:8.2f} ms/frame")
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'screen_size': BENCH_SIZE,
+        'results': results
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    pygame.quit()
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for chart, resolution, name, old_value, value in regressions:
+            print(f'Regression: {chart} x{resolution:g} {name} {old_value:.2f} -> {value:.2f} ms')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
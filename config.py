@@ -1,3 +1,4 @@
+import os
 from math import pi
 from enum import Enum
 
@@ -8,6 +9,10 @@ class Signals(Enum):
     add_param = 2
     del_param = 3
     stop_execution = 4
+    show_data = 5
+    play = 6
+    show_file = 7
+    set_style = 8
 
 
 INF = 10**10
@@ -20,11 +25,49 @@ START_H_ANGLE = pi/4
 START_V_ANGLE = pi/4
 BG_COLOR = 'black'
 FPS = 60
+POINT_RADIUS = 2
+POINT_CHUNK = 65536
+IDLE_FPS = 20
+MESH_WORKERS = 2
+EVAL_WORKERS = None
+EVAL_TILE_NODES = 16384
+COMPACT_MESH_NODES = 250000
+ADAPTIVE_BASE_SIDE = 16
+ADAPTIVE_TOLERANCE = 1e-3
+ADAPTIVE_BUDGET = 65536
+MESH_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'plotter', 'meshes')
+MESH_CACHE_ENTRIES = 16
+MESH_CACHE_SIZE = 512 * 2**20
+MESH_CACHE_WRITE_DELAY = 2
+MESH_CACHE_FORMAT = 2
+MESH_CACHE_STALE_AGE = 600
+EXPRESSION_CACHE_SIZE = 256
+LATTICE_TOLERANCE = 1e-6
+JUMP_RATIO = 1.2
+JUMP_MEDIAN_RATIO = 10
+JUMP_SAMPLE = 65536
+LOD_FRAME_TIME = 1 / 30
+LOD_MIN_SIDE = 8
+LOD_NODE_COST = 3e-6
+LOD_COST_SMOOTHING = 0.2
+LOD_ZOOM_HOLD = 250
+FACE_AMBIENT = 0.3
+ANIMATION_DEPTH = 8
+DATA_MAX_SIDE = 512
+DATA_PROBE_SIDE = 64
+PROFILE_FRAMES = 300
+PROFILE_OVERLAY_KEY = 'f3'
+PROFILE_EXPORT_KEY = 'f4'
+PROFILE_EXPORT_PATH = 'profile'
+EXPORT_SIZE = (400, 400)
+EXPORT_DIR = 'export'
+EXPORT_WORKERS = None
 
 PLOTTER_WINDOW_POS = (950, 35)
 PLOTTER_WINDOW_SIZE = WIDTH, HEIGHT = (900, 980)
 GUI_WINDOW_POS = (80, 60)
 GUI_WINDOW_SIZE = (819, 980)
+GUI_REDRAW_DELAY = 50
 
 LEFT_MOUSE_BUTTON = 1
 RIGHT_MOUSE_BUTTON = 3
@@ -0,0 +1,141 @@
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+from config import INF, DATA_MAX_SIDE, DATA_PROBE_SIDE
+from mesh import build_data_mesh
+
+
+class MappedGrid:
+    # A height map (n, m) or a vertex grid (n, m, 3) left on disk. Display meshes
+    # are cut from the part of it that is on the screen, decimated to at most
+    # DATA_MAX_SIDE nodes a side, so only the pages they use are ever read.
+    def __init__(self, array):
+        if array.ndim == 3 and array.shape[2] != 3 or array.ndim not in (2, 3):
+            raise ValueError(f'expected an (n, m) or (n, m, 3) grid, got {array.shape}')
+        self.array = array
+        n, m = self.shape
+        self.probe_rows = np.unique(np.linspace(0, n - 1, min(n, DATA_PROBE_SIDE)).astype(int))
+        self.probe_cols = np.unique(np.linspace(0, m - 1, min(m, DATA_PROBE_SIDE)).astype(int))
+        self.probe = self.vertices(self.probe_rows, self.probe_cols)
+        self.window = None
+        # The first mesh, when the grid is opened by open_grid_mesh
+        self.mesh = None
+
+    @property
+    def shape(self):
+        return self.array.shape[:2]
+
+    def vertices(self, rows, cols):
+        # Height maps are centred on the origin, one unit per node
+        if self.array.ndim == 3:
+            return np.array(self.array[np.ix_(rows, cols)], dtype=np.float64)
+        n, m = self.shape
+        vertices = np.empty((len(rows), len(cols), 3))
+        vertices[..., 0] = cols - (m - 1) / 2
+        vertices[..., 1] = (rows - (n - 1) / 2)[:, None]
+        vertices[..., 2] = self.array[np.ix_(rows, cols)]
+        Z = vertices[..., 2]
+        Z[~(np.abs(Z) <= INF)] = np.nan
+        return vertices
+
+    def visible_window(self, matrix, width, height):
+        # Rows and columns to display for a view: the probe nodes that land on the
+        # screen give the region, widened by one probe cell on every side
+        points = self.probe @ matrix[:2, :3].T + matrix[:2, 3]
+        with np.errstate(invalid='ignore'):
+            inside = ((points[..., 0] >= 0) & (points[..., 0] < width) &
+                      (points[..., 1] >= 0) & (points[..., 1] < height))
+        last_row, last_col = len(self.probe_rows) - 1, len(self.probe_cols) - 1
+        if inside.any():
+            rows = np.flatnonzero(inside.any(axis=1))
+            cols = np.flatnonzero(inside.any(axis=0))
+            row_begin, row_end = max(rows[0] - 1, 0), min(rows[-1] + 1, last_row)
+            col_begin, col_end = max(cols[0] - 1, 0), min(cols[-1] + 1, last_col)
+        else:
+            # Zoomed in between the probe nodes: the probe cells whose projected
+            # bounds reach the screen
+            corners = np.stack([points[:-1, :-1], points[:-1, 1:], points[1:, :-1], points[1:, 1:]])
+            with np.errstate(invalid='ignore'):
+                low, high = corners.min(axis=0), corners.max(axis=0)
+                overlap = ((high[..., 0] >= 0) & (low[..., 0] < width) &
+                           (high[..., 1] >= 0) & (low[..., 1] < height))
+            if overlap.any():
+                rows = np.flatnonzero(overlap.any(axis=1))
+                cols = np.flatnonzero(overlap.any(axis=0))
+                row_begin, row_end = rows[0], rows[-1] + 1
+                col_begin, col_end = cols[0], cols[-1] + 1
+            else:
+                row_begin, row_end, col_begin, col_end = 0, last_row, 0, last_col
+        row_begin, row_end = self.probe_rows[row_begin], self.probe_rows[row_end]
+        col_begin, col_end = self.probe_cols[col_begin], self.probe_cols[col_end]
+        step = max(-(-max(row_end - row_begin, col_end - col_begin) // (DATA_MAX_SIDE - 1)), 1)
+        return row_begin, row_end, col_begin, col_end, step
+
+    def build(self, window, cancelled=None):
+        row_begin, row_end, col_begin, col_end, step = window
+        rows = np.unique(np.append(np.arange(row_begin, row_end + 1, step), row_end))
+        cols = np.unique(np.append(np.arange(col_begin, col_end + 1, step), col_end))
+        return build_data_mesh(self.vertices(rows, cols), cancelled)
+
+
+def open_grid_mesh(path, row_length, dtype, matrix, width, height, cancelled=None):
+    # Opens a file and meshes the part of it in view, off the render thread:
+    # compressed .npz members are read whole. Returns the grid, with the mesh.
+    grid = open_grid(path, row_length, dtype)
+    grid.window = grid.visible_window(matrix, width, height)
+    grid.mesh = grid.build(grid.window, cancelled)
+    return grid
+
+
+def open_grid(path, row_length=None, dtype=np.float32):
+    # .npy and stored .npz members are mapped, anything else is taken for a raw
+    # C-ordered array of dtype with row_length values a row
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == '.npy':
+        array = np.load(path, mmap_mode='r')
+    elif suffix == '.npz':
+        array = map_npz(path)
+    else:
+        if not row_length:
+            raise ValueError('the row length of a raw file is required')
+        array = np.memmap(path, dtype=dtype, mode='r')
+        array = array[:len(array) - len(array) % row_length].reshape(-1, row_length)
+    return MappedGrid(array)
+
+
+def read_text_grid(path):
+    # Rows of heights separated by commas or whitespace, read whole and returned
+    # as the vertices of the height map
+    with open(path) as file:
+        delimiter = ',' if ',' in file.readline() else None
+    grid = MappedGrid(np.loadtxt(path, delimiter=delimiter, ndmin=2))
+    n, m = grid.shape
+    return grid.vertices(np.arange(n), np.arange(m))
+
+
+def map_npz(path, name='z'):
+    # np.load reads .npz members whole; stored (uncompressed) ones are plain .npy
+    # files inside the zip and can be mapped at their offset instead
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        if not names:
+            raise ValueError(f'{path} is empty')
+        info = archive.getinfo(name + '.npy' if name + '.npy' in names else names[0])
+        if info.compress_type != zipfile.ZIP_STORED:
+            with archive.open(info) as file:
+                return np.lib.format.read_array(file)
+    with open(path, 'rb') as file:
+        file.seek(info.header_offset)
+        name_length, extra_length = struct.unpack('<26xHH', file.read(30))
+        file.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
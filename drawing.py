@@ -0,0 +1,210 @@
+from collections import deque
+from functools import lru_cache
+from itertools import repeat
+
+import numpy as np
+import pygame
+
+from config import POINT_RADIUS, POINT_CHUNK
+
+
+def draw_points(screen, color, points):
+    width, height = screen.get_size()
+    margin = POINT_RADIUS + 1
+    visible = ((points[:, 0] > -margin) & (points[:, 0] < width + margin) &
+               (points[:, 1] > -margin) & (points[:, 1] < height + margin))
+    if screen.get_bytesize() == 3:
+        for point in points[visible].tolist():
+            pygame.draw.circle(screen, color, point, POINT_RADIUS)
+        return
+    # Dots are written straight into the pixel buffer. pygame.draw.circle truncates
+    # the centre to whole pixels, and so does astype
+    centers = points[visible].astype(np.intp)
+    dot_x, dot_y = dot_offsets(POINT_RADIUS)
+    pixels = pygame.surfarray.pixels2d(screen)
+    if len(centers) * len(dot_x) < width * height:
+        for start in range(0, len(centers), POINT_CHUNK):
+            chunk = centers[start:start + POINT_CHUNK]
+            xs = (chunk[:, :1] + dot_x).ravel()
+            ys = (chunk[:, 1:] + dot_y).ravel()
+            inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+            pixels[xs[inside], ys[inside]] = screen.map_rgb(pygame.Color(color))
+    else:
+        # Dense clouds: mark the centres once, then grow them into dots with one
+        # shifted pass per dot pixel, independent of the number of points
+        centers += margin
+        marked = np.zeros((width + 2 * margin, height + 2 * margin), dtype=bool)
+        marked[centers[:, 0], centers[:, 1]] = True
+        dots = np.zeros((width, height), dtype=bool)
+        for x, y in zip((margin - dot_x).tolist(), (margin - dot_y).tolist()):
+            dots |= marked[x:x + width, y:y + height]
+        pixels[dots] = screen.map_rgb(pygame.Color(color))
+    del pixels
+
+
+@lru_cache()
+def dot_offsets(radius):
+    # Pixel offsets of a dot drawn by pygame.draw.circle around its centre
+    center = radius + 1
+    sprite = pygame.Surface((2 * center + 1, 2 * center + 1))
+    pygame.draw.circle(sprite, 'white', (center, center), radius)
+    xs, ys = np.nonzero(pygame.surfarray.array2d(sprite))
+    return xs - center, ys - center
+
+
+def draw_polylines(screen, color, vertices, breaks):
+    for start, end in zip(breaks, breaks[1:]):
+        pygame.draw.lines(screen, color, False, vertices[start:end])
+
+
+def edge_polylines(points, edges, joined, width, height):
+    # Vertices of the polylines to draw for the edges, and where each one begins
+    if not len(edges):
+        return [], []
+    starts = points[edges[:, 0]]
+    ends = points[edges[:, 1]]
+    t_start, t_end, visible = clip_segments(starts, ends, -1, -1, width + 1, height + 1)
+    # Only endpoints far outside the screen are clipped here: pygame clips the rest
+    # itself, and moving an endpoint would change how the segment is rasterized
+    margin = max(width, height)
+    far = visible & ((np.minimum(starts, ends) < -margin) |
+                     (np.maximum(starts, ends) > (width + margin, height + margin))).any(axis=1)
+    clipped_start = np.zeros(len(edges), dtype=bool)
+    clipped_end = np.zeros(len(edges), dtype=bool)
+    if far.any():
+        t_start, t_end, _ = clip_segments(starts[far], ends[far], -margin, -margin,
+                                          width + margin, height + margin)
+        deltas = ends[far] - starts[far]
+        clipped_start[far] = t_start > 0
+        clipped_end[far] = t_end < 1
+        ends[far] = starts[far] + t_end[:, None] * deltas
+        starts[far] += t_start[:, None] * deltas
+    # A segment continues the previous polyline only if both reach their common node
+    chained = joined & visible & ~clipped_start
+    chained[1:] &= visible[:-1] & ~clipped_end[:-1]
+    selected = np.flatnonzero(visible)
+    if not len(selected):
+        return [], []
+    starts, ends, chained = starts[selected], ends[selected], chained[selected]
+    # A node closing a segment that stays within one pixel is dropped from its
+    # polyline, so the segment merges into the next one
+    tiny = (np.floor(starts) == np.floor(ends)).all(axis=1)
+    chained_next = np.append(chained[1:], False)
+    emitted = np.stack((~chained, ~(chained_next & tiny)), axis=-1).ravel()
+    vertices = np.stack((starts, ends), axis=1).reshape(-1, 2)[emitted].tolist()
+    breaks = (np.cumsum(emitted)[0::2][~chained] - 1).tolist()
+    breaks.append(len(vertices))
+    return vertices, breaks
+
+
+def draw_faces(screen, points, quads, colors, owners, line_colors):
+    # Quads of vertex indices are drawn in the given order, filled and outlined
+    # with the line colour of their owner chart unless that is None
+    width, height = screen.get_size()
+    corners = points[quads.T]
+    low = np.minimum(np.minimum(corners[0], corners[1]), np.minimum(corners[2], corners[3]))
+    high = np.maximum(np.maximum(corners[0], corners[1]), np.maximum(corners[2], corners[3]))
+    visible = (high[:, 0] > -1) & (low[:, 0] < width + 1) & (high[:, 1] > -1) & (low[:, 1] < height + 1)
+    # pygame walks every scanline of a polygon, even those off the screen
+    margin = max(width, height)
+    far = (low < -margin).any(axis=1) | (high[:, 0] > width + margin) | (high[:, 1] > height + margin)
+    quads, colors, owners, far = quads[visible], colors[visible], owners[visible], far[visible]
+    if not len(quads):
+        return
+    polygons = quad_polygons(points, quads, far, -margin, -margin, width + margin, height + margin)
+    outlined = np.array([color is not None for color in line_colors])
+    if not outlined.any():
+        # map keeps the loop over the quads out of the interpreter
+        deque(map(pygame.draw.polygon, repeat(screen), colors.tolist(), polygons), maxlen=0)
+        return
+    if screen.get_bytesize() == 3 or len(quads) >= 2**24:
+        for quad, color, owner in zip(polygons, colors.tolist(), owners.tolist()):
+            pygame.draw.polygon(screen, color, quad)
+            if line_colors[owner] is not None:
+                pygame.draw.polygon(screen, line_colors[owner], quad, 1)
+        return
+    # An outline costs more to draw than its quad, so the quads are only filled,
+    # with their number, into an id buffer. Faces and outlines are then written
+    # from it at once: the outlines are the borders between the quads left in view.
+    ids = id_buffer(width, height)
+    ids.fill(0)
+    deque(map(pygame.draw.polygon, repeat(ids), range(1, len(quads) + 1), polygons), maxlen=0)
+    # Only the part of the screen the quads cover is gone over
+    left, top = np.clip(np.floor(low[visible].min(axis=0)).astype(int), 0, (width, height))
+    right, bottom = np.clip(np.ceil(high[visible].max(axis=0)).astype(int) + 2, 0, (width, height))
+    drawn = pygame.surfarray.pixels2d(ids)[left:right, top:bottom]
+    covered = drawn != 0
+    face_pixels = np.zeros(len(quads) + 1, dtype=np.uint32)
+    face_pixels[1:] = pygame.surfarray.map_array(screen, colors[:, None, :])[:, 0]
+    line_pixels = np.array([0 if color is None else screen.map_rgb(pygame.Color(color)) for color in line_colors],
+                           dtype=np.uint32)
+    line_pixels = np.append(0, line_pixels[owners])
+    has_outline = covered if outlined.all() else np.append(False, outlined[owners]).take(drawn)
+    # Of two neighbouring pixels of different quads the left or upper one takes
+    # the outline, unless only the other one is outlined
+    lines = np.zeros(drawn.shape, dtype=bool)
+    border = drawn[:-1] != drawn[1:]
+    lines[:-1] |= border & has_outline[:-1]
+    lines[1:] |= border & ~has_outline[:-1] & has_outline[1:]
+    border = drawn[:, :-1] != drawn[:, 1:]
+    lines[:, :-1] |= border & has_outline[:, :-1]
+    lines[:, 1:] |= border & ~has_outline[:, :-1] & has_outline[:, 1:]
+    pixels = pygame.surfarray.pixels2d(screen)
+    np.copyto(pixels[left:right, top:bottom], face_pixels.take(drawn), where=covered)
+    pixels[left:right, top:bottom][lines] = line_pixels[drawn[lines]]
+    del pixels
+
+
+def quad_polygons(points, quads, far, left, top, right, bottom):
+    # The corners of every quad, clipped to the rectangle if far is set. Quads
+    # clipped away become a point off the screen, so the list stays in step.
+    # Quads share their corners, so every vertex becomes a Python list only once,
+    # and the polygons are put together by map and zip rather than a Python loop
+    corner = points.tolist().__getitem__
+    a, b, c, d = quads.T.tolist()
+    polygons = list(zip(map(corner, a), map(corner, b), map(corner, c), map(corner, d)))
+    for index in np.flatnonzero(far).tolist():
+        polygon = clip_polygon(polygons[index], left, top, right, bottom)
+        polygons[index] = polygon if len(polygon) >= 3 else [[left, top]] * 3
+    return polygons
+
+
+@lru_cache(maxsize=1)
+def id_buffer(width, height):
+    return pygame.Surface((width, height), 0, 32)
+
+
+def clip_polygon(polygon, left, top, right, bottom):
+    # Sutherland-Hodgman against each side of the rectangle in turn
+    for axis, bound, sign in ((0, left, -1), (0, right, 1), (1, top, -1), (1, bottom, 1)):
+        clipped = []
+        for start, end in zip(polygon[-1:] + polygon[:-1], polygon):
+            start_inside = (start[axis] - bound) * sign <= 0
+            end_inside = (end[axis] - bound) * sign <= 0
+            if start_inside != end_inside:
+                t = (bound - start[axis]) / (end[axis] - start[axis])
+                clipped.append([start[0] + t * (end[0] - start[0]), start[1] + t * (end[1] - start[1])])
+            if end_inside:
+                clipped.append(end)
+        polygon = clipped
+        if not polygon:
+            break
+    return polygon
+
+
+def clip_segments(starts, ends, left, top, right, bottom):
+    # Liang-Barsky: the parameter range of every segment inside the rectangle
+    deltas = ends - starts
+    t_start = np.zeros(len(starts))
+    t_end = np.ones(len(starts))
+    visible = np.ones(len(starts), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for axis, low, high in ((0, left, right), (1, top, bottom)):
+            delta = deltas[:, axis]
+            for p, q in ((-delta, starts[:, axis] - low), (delta, high - starts[:, axis])):
+                t = q / p
+                t_start = np.where(p < 0, np.maximum(t_start, t), t_start)
+                t_end = np.where(p > 0, np.minimum(t_end, t), t_end)
+                visible &= (p != 0) | (q >= 0)
+    visible &= t_start <= t_end
+    return t_start, t_end, visible
@@ -0,0 +1,187 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+from multiprocessing import Pool
+from time import perf_counter
+
+import numpy as np
+import pygame
+
+from config import DEFAULT_CHARTS, START_H_ANGLE, START_V_ANGLE, EXPORT_SIZE, EXPORT_DIR, EXPORT_WORKERS
+from expressions import ARGUMENTS, NAMESPACE, TIME, compile_expression, normalize
+from mesh import build_mesh
+from plotter import Chart, add_axis_charts, init_headless, render_frame
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The offscreen surface of a worker process
+screen = None
+
+
+def init_worker(size):
+    global screen
+    # SDL would turn SIGTERM into a quit event, and the pool could not stop the worker
+    os.environ['SDL_NO_SIGNAL_HANDLERS'] = '1'
+    np.seterr(all='ignore')
+    screen = init_headless(size)
+
+
+def peak_memory():
+    # Peak resident memory of the process in KiB, None where it is not known
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def export_job(job):
+    # Meshes one chart with one set of parameter values and saves a PNG for every
+    # camera angle, so the views share the mesh. A chart that cannot be meshed
+    # gives failed frames and no images.
+    index, spec, params, name, options = job
+    start = perf_counter()
+    chart = Chart()
+    chart.set_style(**options['style'])
+    try:
+        chart.set_mesh(build_mesh(compile_expression(normalize(spec[0])).bind(params), *spec[1:]))
+    except Exception as err:
+        return failed_frames(job, str(err)), os.getpid(), perf_counter() - start, peak_memory()
+    charts = {}
+    if options['axes']:
+        add_axis_charts(charts)
+    charts[0] = chart
+    width, height = screen.get_size()
+    frames = []
+    for view, (h_angle, v_angle) in enumerate(options['angles']):
+        for chart in charts.values():
+            chart.move(width // 2, 0, -height // 2)
+            chart.rotate(h_angle, v_angle)
+            chart.zoom(options['zoom'])
+        render_frame(screen, charts)
+        path = os.path.join(options['directory'], f'{name}_{view}.png')
+        pygame.image.save(screen, path)
+        frames.append({'file': os.path.basename(path), 'chart': spec[0], 'index': index, 'params': params,
+                       'h_angle': h_angle, 'v_angle': v_angle})
+    return frames, os.getpid(), perf_counter() - start, peak_memory()
+
+
+def failed_frames(job, error):
+    index, spec, params, _, options = job
+    return [{'file': None, 'chart': spec[0], 'index': index, 'params': params, 'h_angle': h_angle,
+             'v_angle': v_angle, 'error': error} for h_angle, v_angle in options['angles']]
+
+
+def check_specs(specs, names):
+    # Errors of the charts whose formulas do not compile or use parameters that
+    # are not swept, by chart index; these are never sent to the workers
+    errors = {}
+    for index, spec in enumerate(specs):
+        try:
+            unbound = sorted(set(compile_expression(normalize(spec[0])).params) - set(names))
+            if unbound:
+                raise NameError(f"name '{unbound[0]}' is not defined")
+        except Exception as err:
+            errors[index] = str(err)
+    return errors
+
+
+def sweep(param_ranges):
+    # Every combination of the values of the parameters, each range being
+    # (name, from, to, count)
+    names = [name for name, *_ in param_ranges]
+    values = [np.linspace(begin, end, count).round(6).tolist() for _, begin, end, count in param_ranges]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def export_jobs(specs, param_ranges, options):
+    sweeps = sweep(param_ranges)
+    return [(index, spec, params, f'chart{index:03}_{number:04}', options)
+            for index, spec in enumerate(specs)
+            for number, params in enumerate(sweeps)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render charts to PNG files without a window')
+    parser.add_argument('-c', '--charts', help='JSON list of charts as in DEFAULT_CHARTS, the default charts if '
+                                               'not given')
+    parser.add_argument('-o', '--output', default=EXPORT_DIR, help='directory for the images and frames.json')
+    parser.add_argument('-s', '--size', type=int, nargs=2, default=EXPORT_SIZE, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('-a', '--angles', type=float, nargs='+', default=(START_H_ANGLE, START_V_ANGLE),
+                        metavar='ANGLE', help='horizontal and vertical angle pairs, one image for each')
+    parser.add_argument('-p', '--param', nargs=4, action='append', default=[],
+                        metavar=('NAME', 'FROM', 'TO', 'COUNT'), help='parameter values to sweep, repeatable')
+    parser.add_argument('-z', '--zoom', type=float, default=1)
+    parser.add_argument('-j', '--jobs', type=int, default=EXPORT_WORKERS, help='worker processes')
+    parser.add_argument('--points', action='store_true')
+    parser.add_argument('--faces', action='store_true')
+    parser.add_argument('--no-lines', action='store_true')
+    parser.add_argument('--axes', action='store_true')
+    args = parser.parse_args()
+    if len(args.angles) % 2:
+        parser.error('angles go in horizontal and vertical pairs')
+    try:
+        param_ranges = [(name, float(begin), float(end), int(count)) for name, begin, end, count in args.param]
+    except ValueError as err:
+        parser.error(str(err))
+    for name, *_ in param_ranges:
+        if name in (TIME, *ARGUMENTS, *NAMESPACE):
+            parser.error(f"'{name}' is a reserved name")
+
+    specs = DEFAULT_CHARTS
+    if args.charts:
+        with open(args.charts) as file:
+            specs = [tuple(spec) for spec in json.load(file)]
+    options = {
+        'angles': list(zip(args.angles[::2], args.angles[1::2])),
+        'zoom': args.zoom,
+        'axes': args.axes,
+        'style': {'show_points': args.points, 'show_lines': not args.no_lines, 'show_faces': args.faces},
+        'directory': args.output
+    }
+    os.makedirs(args.output, exist_ok=True)
+    jobs = export_jobs(specs, param_ranges, options)
+    errors = check_specs(specs, [name for name, *_ in param_ranges])
+
+    start = perf_counter()
+    frames = []
+    workers = {}
+    with Pool(args.jobs or os.cpu_count(), initializer=init_worker, initargs=(tuple(args.size),)) as pool:
+        # In job order, so frames.json is too
+        results = pool.imap(export_job, [job for job in jobs if job[0] not in errors])
+        for job in jobs:
+            if job[0] in errors:
+                job_frames = failed_frames(job, errors[job[0]])
+            else:
+                job_frames, pid, seconds, memory = next(results)
+                worker = workers.setdefault(pid, {'frames': 0, 'seconds': 0, 'peak_kib': None})
+                worker['frames'] += sum('error' not in frame for frame in job_frames)
+                worker['seconds'] += seconds
+                if memory is not None:
+                    worker['peak_kib'] = max(worker['peak_kib'] or 0, memory)
+            if job_frames and 'error' in job_frames[0]:
+                print("Error:", f"{job[1][0]} {job[2]}:", job_frames[0]['error'])
+            frames += job_frames
+    elapsed = perf_counter() - start
+
+    with open(os.path.join(args.output, 'frames.json'), 'w') as file:
+        json.dump(frames, file, indent=2)
+    failed = sum('error' in frame for frame in frames)
+    for pid, worker in sorted(workers.items()):
+        memory = 'unknown' if worker['peak_kib'] is None else f"{worker['peak_kib'] / 1024:.1f} MiB"
+        print(f"worker {pid:>7}: {worker['frames']:>6} frames in {worker['seconds']:8.2f} s, "
+              f"peak memory {memory}")
+    saved = len(frames) - failed
+    print(f'{saved} frames in {elapsed:.2f} s, {saved / elapsed:.1f} frames/s, {len(workers)} workers')
+    if failed:
+        print(f'{failed} frames failed')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import ast
+from collections import Counter
+from functools import lru_cache
+from math import e, pi
+
+import numpy as np
+
+from config import FUNCTION_SUBSTITUTIONS, EXPRESSION_CACHE_SIZE
+
+ARGUMENTS = ('x', 'y')
+TIME = 't'
+NAMESPACE = {'np': np, 'e': e, 'pi': pi}
+# Formulas that bind names of their own are evaluated as they are
+UNSUPPORTED_NODES = (ast.Lambda, ast.NamedExpr, ast.comprehension)
+
+
+class Expression:
+    def __init__(self, text):
+        self.text = text
+        tree = ast.parse(text, '<formula>', 'eval')
+        names = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+        self.params = tuple(sorted(names - set(ARGUMENTS) - set(NAMESPACE) - {TIME}))
+        self.animated = TIME in names
+        terms, body = optimize(tree)
+        self.terms = [(name, dependency, compile(ast.Expression(node), '<formula>', 'eval'))
+                      for name, dependency, node in terms]
+        self.code = compile(body, '<formula>', 'eval')
+
+    def __call__(self, x, y, params, t=0):
+        namespace = {**NAMESPACE, **params, 'x': x, 'y': y, TIME: t}
+        for name, _, code in self.terms:
+            namespace[name] = eval(code, namespace)
+        return np.broadcast_to(eval(self.code, namespace), np.broadcast_shapes(np.shape(x), np.shape(y)))
+
+    def prepare(self, x_axis, y_axis, params, t=0):
+        # Evaluates the terms of x alone, y alone or neither once, on the axes shaped
+        # to broadcast against each other, and returns a function of rows begin:end
+        namespace = {**NAMESPACE, **params, 'x': x_axis[None, :], 'y': y_axis[:, None], TIME: t}
+        for name, dependency, code in self.terms:
+            if dependency != 'xy':
+                namespace[name] = eval(code, namespace)
+        rows = [name for name, value in namespace.items() if isinstance(value, np.ndarray) and
+                value.ndim == 2 and value.shape[0] == len(y_axis) > 1]
+
+        def evaluate_rows(begin, end):
+            tile = {**namespace, **{name: namespace[name][begin:end] for name in rows}}
+            for name, dependency, code in self.terms:
+                if dependency == 'xy':
+                    tile[name] = eval(code, tile)
+            return np.broadcast_to(eval(self.code, tile), (end - begin, len(x_axis)))
+
+        return evaluate_rows
+
+    def bind(self, params):
+        return BoundExpression(self, {name: params[name] for name in self.params if name in params})
+
+
+class BoundExpression:
+    # An expression with its parameter values, and the time for animated ones
+    def __init__(self, expression, params, t=0):
+        self.expression = expression
+        self.params = params
+        self.t = t
+        self.key = (expression.text, tuple(sorted(params.items())), t)
+
+    def __call__(self, x, y):
+        return self.expression(x, y, self.params, self.t)
+
+    def prepare(self, x_axis, y_axis):
+        return self.expression.prepare(x_axis, y_axis, self.params, self.t)
+
+    def at(self, t):
+        return BoundExpression(self.expression, self.params, t)
+
+
+def optimize(tree):
+    # Splits a formula into terms evaluated before it: the largest parts that depend
+    # on x alone, on y alone or on neither, which then cost O(n + m) on the axes
+    # instead of O(n * m) on the grid, and every part that occurs more than once.
+    # Returns [(name, dependency, node)] in evaluation order and the remaining body.
+    if any(isinstance(node, UNSUPPORTED_NODES) for node in ast.walk(tree)):
+        return [], tree
+    tree = ast.fix_missing_locations(ConstantFolder().visit(tree))
+    counts = Counter(ast.dump(node) for node in ast.walk(tree.body) if not is_trivial(node))
+    terms = []
+    names = {}
+
+    def visit(node, parent_dependency):
+        if not isinstance(node, ast.expr) or is_trivial(node):
+            return node
+        dependency = ''.join(sorted({child.id for child in ast.walk(node)
+                                     if isinstance(child, ast.Name) and child.id in ARGUMENTS}))
+        repeated = counts[ast.dump(node)] > 1
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                setattr(node, field, [visit_child(item, dependency) for item in value])
+            elif isinstance(value, ast.AST) and not (isinstance(node, ast.Call) and field == 'func'):
+                setattr(node, field, visit_child(value, dependency))
+        key = ast.dump(node)
+        if key not in names:
+            if not (repeated or dependency != 'xy' and parent_dependency == 'xy'):
+                return node
+            names[key] = f'__term{len(terms)}'
+            terms.append((names[key], dependency, node))
+        return ast.Name(names[key], ast.Load())
+
+    def visit_child(node, dependency):
+        if isinstance(node, ast.keyword):
+            node.value = visit(node.value, dependency)
+            return node
+        return visit(node, dependency)
+
+    body = ast.fix_missing_locations(ast.Expression(visit(tree.body, 'xy')))
+    return [(name, dependency, ast.fix_missing_locations(node)) for name, dependency, node in terms], body
+
+
+class ConstantFolder(ast.NodeTransformer):
+    def visit_Name(self, node):
+        if node.id in NAMESPACE and isinstance(NAMESPACE[node.id], float):
+            return ast.Constant(NAMESPACE[node.id])
+        return node
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if not (is_number(node.left) and is_number(node.right)):
+            return node
+        # Huge integer powers would hang here rather than at evaluation
+        if isinstance(node.op, ast.Pow) and abs(node.right.value) > 64:
+            return node
+        return fold(node)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        return fold(node) if is_number(node.operand) else node
+
+
+def fold(node):
+    try:
+        return ast.Constant(eval(compile(ast.fix_missing_locations(ast.Expression(node)), '<formula>', 'eval')))
+    except Exception:
+        return node
+
+
+def is_number(node):
+    return isinstance(node, ast.Constant) and type(node.value) in (int, float, complex)
+
+
+def is_trivial(node):
+    return isinstance(node, (ast.Name, ast.Constant, ast.Attribute))
+
+
+def normalize(text):
+    # Formulas that differ only in spacing compile to the same cached expression;
+    # the text is reformatted from its tree, which keeps keywords apart
+    for pattern, repl in FUNCTION_SUBSTITUTIONS.items():
+        text = text.replace(pattern, repl)
+    try:
+        return ast.unparse(ast.parse(text.strip(), '<formula>', 'eval'))
+    except SyntaxError:
+        return text
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_expression(text):
+    return Expression(text)
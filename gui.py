@@ -1,30 +1,229 @@
 from PyQt5.QtWidgets import (QApplication, QWidget, QScrollArea,
                              QVBoxLayout, QGroupBox, QPushButton,
                              QHBoxLayout, QAbstractSpinBox, QColorDialog,
-                             QInputDialog, QSlider
+                             QInputDialog, QSlider, QFileDialog, QListView,
+                             QAbstractItemView, QStyledItemDelegate
                              )
 from PyQt5 import uic
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QPoint, QSize, QTimer
 from PyQt5.QtGui import QFont
 from functools import partial
+import os
 import sys
 
-from config import Signals, GUI_WINDOW_POS, GUI_WINDOW_SIZE, DEFAULT_CHARTS, FUNCTION_SUBSTITUTIONS
+import numpy as np
 
+from config import Signals, GUI_WINDOW_POS, GUI_WINDOW_SIZE, GUI_REDRAW_DELAY, DEFAULT_CHARTS
+from data_files import read_text_grid
+from expressions import ARGUMENTS, NAMESPACE, TIME, compile_expression, normalize
+from shared_arrays import SharedArrayWriter
 
-class ChartWidget(QWidget):
-    def __init__(self, id_, plot_chart_func, hide_chart_func, del_chart_func):
-        super().__init__()
+# The forms are compiled once, loadUi would parse them again for every widget
+ChartForm, _ = uic.loadUiType('res/chart_widget.ui')
+DataForm, _ = uic.loadUiType('res/data_widget.ui')
+ParamForm, _ = uic.loadUiType('res/param_widget.ui')
+
+
+class ChartEntry:
+    # A row of the chart list. Its widget only exists while the row is on the
+    # screen, so everything the row shows is kept here.
+    def __init__(self, id_, func='', x_from=-100, x_to=100, y_from=-100, y_to=100, x_step=5, y_step=5,
+                 scale=1):
         self.id = id_
-        self.plot_chart_func = plot_chart_func
-        self.hide_chart_func = hide_chart_func
-        self.del_chart_func = del_chart_func
+        self.func = func
+        self.x_from = x_from
+        self.x_to = x_to
+        self.y_from = y_from
+        self.y_to = y_to
+        self.x_step = x_step
+        self.y_step = y_step
+        self.scale = scale
+        self.color = (255, 255, 255)
+        self.show_points = False
+        self.show_lines = True
+        self.show_faces = False
+        self.adaptive = False
+        self.plotted = False
+        self.error = ''
+
+    def get_id(self):
+        return self.id
+
+    def get_params(self):
+        return (
+            normalize(self.func),
+            self.x_from, self.x_to, self.y_from, self.y_to, self.x_step, self.y_step, self.scale,
+            self.color, self.show_points, self.show_lines, self.show_faces, self.adaptive
+        )
+
+    def validate(self):
+        # The error message for the current input, empty if it can be plotted
+        try:
+            assert self.x_from < self.x_to
+            assert self.y_from < self.y_to
+            assert self.x_step < self.x_to - self.x_from
+            assert self.y_step < self.y_to - self.y_from
+            assert self.x_step and self.y_step
+            compile_expression(normalize(self.func))
+            return ''
+        except AssertionError:
+            return 'Incorrect bounds!'
+        except Exception:
+            return 'Incorrect function!'
+
+    def get_param_names(self):
+        # The parameters the formula uses, none if it does not compile
+        try:
+            return set(compile_expression(normalize(self.func)).params)
+        except Exception:
+            return set()
+
+    def signal(self):
+        return [Signals.show_chart, self.id, *self.get_params()]
+
+    def redraw_signal(self):
+        return self.signal()
+
+
+class DataEntry:
+    # A row of the chart list for a data file, which the plotter maps itself,
+    # or for vertices already loaded here and shared through handle
+    def __init__(self, id_, path, row_length=None, dtype='float32', handle=None):
+        self.id = id_
+        self.name = os.path.basename(path)
+        self.path = path
+        self.row_length = row_length
+        self.dtype = dtype
+        self.handle = handle
         self.color = (255, 255, 255)
-        self.points_visibility = False
-        self.lines_visibility = True
+        self.show_points = False
+        self.show_lines = True
+        self.show_faces = False
+        self.plotted = True
+        self.error = ''
+
+    def get_id(self):
+        return self.id
+
+    def validate(self):
+        return ''
+
+    def get_param_names(self):
+        return set()
+
+    def signal(self):
+        style = [self.color, self.show_points, self.show_lines, self.show_faces]
+        if self.handle is not None:
+            return [Signals.show_data, self.id, self.handle, *style]
+        return [Signals.show_file, self.id, self.path, self.row_length, self.dtype, *style]
+
+    def redraw_signal(self):
+        # The data stays as it is, only its style changes
+        return [Signals.set_style, self.id, self.color, self.show_points, self.show_lines, self.show_faces]
+
+
+class ChartListModel(QAbstractListModel):
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.UserRole and index.isValid():
+            return self.entries[index.row()]
+        return None
+
+    def append(self, entries):
+        self.beginInsertRows(QModelIndex(), len(self.entries), len(self.entries) + len(entries) - 1)
+        self.entries += entries
+        self.endInsertRows()
+
+    def remove(self, entry):
+        row = self.entries.index(entry)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.entries[row]
+        self.endRemoveRows()
+
+
+class ChartDelegate(QStyledItemDelegate):
+    # Rows are drawn by ChartWidget editors, opened by the main window for the
+    # visible rows only
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), 180 if isinstance(index.data(Qt.UserRole), ChartEntry) else 120)
+
+    def createEditor(self, parent, option, index):
+        entry = index.data(Qt.UserRole)
+        widget_class = ChartWidget if isinstance(entry, ChartEntry) else DataWidget
+        return widget_class(entry, self.window.schedule_redraw, self.window.plot_or_hide_chart,
+                            self.window.del_chart, parent)
+
+    def updateEditorGeometry(self, editor, option, index):
+        editor.setGeometry(option.rect)
+
+
+class EntryWidget(QWidget):
+    # What the widgets of formula and data rows have in common: the style
+    # controls, the Plot/Hide button and the colour
+    def __init__(self, entry, redraw_chart_func, plot_or_hide_chart_func, del_chart_func, parent=None):
+        super().__init__(parent)
+        self.entry = entry
+        self.redraw_chart_func = redraw_chart_func
+        self.plot_or_hide_chart_func = plot_or_hide_chart_func
+        self.del_chart_func = del_chart_func
         self._initUI()
 
+    def store(self):
+        self.entry.show_points = self.show_points_checkbox.isChecked()
+        self.entry.show_lines = self.show_lines_checkbox.isChecked()
+        self.entry.show_faces = self.show_faces_checkbox.isChecked()
+
+    def show_state(self):
+        if self.entry.plotted:
+            self.plot_btn.setText('Hide')
+            self.plot_btn.setStyleSheet('border: 3px solid black;border-radius:5px;background-color:#ff5500')
+        else:
+            self.plot_btn.setText('Plot')
+            self.plot_btn.setStyleSheet('border: 3px solid black;border-radius:5px;background-color:#00aa00')
+
+    def show_color(self):
+        if self.entry.color != (255, 255, 255):
+            self.color_btn.setStyleSheet(
+                f'border:3px solid black;border-radius:5px;background-color:rgb{self.entry.color};')
+
+    def redraw_chart(self):
+        self.store()
+        self.redraw_chart_func(self.entry)
+
+    def plot_or_hide_chart(self):
+        self.store()
+        self.plot_or_hide_chart_func(self.entry)
+        self.show_state()
+
+    def change_color(self):
+        color = QColorDialog.getColor()
+        if color.isValid():
+            self.entry.color = color.getRgb()[:3]
+            self.show_color()
+            self.redraw_chart()
+
+
+class ChartWidget(EntryWidget, ChartForm):
     def _initUI(self):
-        uic.loadUi('res/chart_widget.ui', self)
+        self.setupUi(self)
+        self.set_params(*self.entry.get_params()[1:8])
+        self.function_input.setText(self.entry.func)
+        self.show_points_checkbox.setChecked(self.entry.show_points)
+        self.show_lines_checkbox.setChecked(self.entry.show_lines)
+        self.show_faces_checkbox.setChecked(self.entry.show_faces)
+        self.adaptive_checkbox.setChecked(self.entry.adaptive)
+        self.show_color()
+        self.show_state()
         self.x_from_spin_box.setButtonSymbols(QAbstractSpinBox.NoButtons)
         self.x_to_spin_box.setButtonSymbols(QAbstractSpinBox.NoButtons)
         self.x_step_spin_box.setButtonSymbols(QAbstractSpinBox.NoButtons)
@@ -43,13 +242,14 @@ class ChartWidget(QWidget):
 
         self.plot_btn.clicked.connect(self.plot_or_hide_chart)
         self.function_input.returnPressed.connect(self.plot_or_hide_chart)
-        self.delete_btn.clicked.connect(partial(self.del_chart_func, self))
+        self.delete_btn.clicked.connect(partial(self.del_chart_func, self.entry))
         self.color_btn.clicked.connect(self.change_color)
         self.show_points_checkbox.stateChanged.connect(self.redraw_chart)
         self.show_lines_checkbox.stateChanged.connect(self.redraw_chart)
+        self.show_faces_checkbox.stateChanged.connect(self.redraw_chart)
+        self.adaptive_checkbox.stateChanged.connect(self.redraw_chart)
 
-    def set_params(self, func, x_from, x_to, y_from, y_to, x_step, y_step, scale):
-        self.function_input.setText(func)
+    def set_params(self, x_from, x_to, y_from, y_to, x_step, y_step, scale):
         self.x_from_spin_box.setValue(x_from)
         self.x_to_spin_box.setValue(x_to)
         self.x_step_spin_box.setValue(x_step)
@@ -58,77 +258,40 @@ class ChartWidget(QWidget):
         self.y_step_spin_box.setValue(y_step)
         self.scale_spin_box.setValue(scale)
 
-    def get_id(self):
-        return self.id
+    def store(self):
+        super().store()
+        entry = self.entry
+        entry.func = self.function_input.text()
+        entry.x_from, entry.x_to = self.x_from_spin_box.value(), self.x_to_spin_box.value()
+        entry.y_from, entry.y_to = self.y_from_spin_box.value(), self.y_to_spin_box.value()
+        entry.x_step, entry.y_step = self.x_step_spin_box.value(), self.y_step_spin_box.value()
+        entry.scale = self.scale_spin_box.value()
+        entry.adaptive = self.adaptive_checkbox.isChecked()
 
-    def get_params(self):
-        return (
-            self.get_func(),
-            self.x_from_spin_box.value(), self.x_to_spin_box.value(),
-            self.y_from_spin_box.value(), self.y_to_spin_box.value(),
-            self.x_step_spin_box.value(), self.y_step_spin_box.value(),
-            self.scale_spin_box.value(), self.color,
-            self.show_points_checkbox.isChecked(), self.show_lines_checkbox.isChecked()
-        )
-
-    def get_func(self):
-        func = self.function_input.text()
-        for pattern, repl in FUNCTION_SUBSTITUTIONS.items():
-            func = func.replace(pattern, repl)
-        return f'lambda x, y: np.zeros(x.shape)+{func}'
+    def show_state(self):
+        super().show_state()
+        self.error_display_label.setText(self.entry.error)
 
-    def validate_user_input(self, show_errors=True):
-        try:
-            func, x_from, x_to, y_from, y_to, x_step, y_step, _, _, _, _ = self.get_params()
-            assert x_from < x_to
-            assert y_from < y_to
-            assert x_step < x_to - x_from
-            assert y_step < y_to - y_from
-            assert x_step and y_step
-            eval(func)
-            self.show_error_message('')
-            return True
-        except AssertionError:
-            if show_errors:
-                self.show_error_message('Incorrect bounds!')
-            return False
-        except Exception:
-            if show_errors:
-                self.show_error_message('Incorrect function!')
-            return False
 
-    def show_error_message(self, msg):
-        self.error_display_label.setText(msg)
-
-    def redraw_chart(self):
-        if self.plot_btn.text() == 'Plot':
-            return
-        if not self.validate_user_input(show_errors=False):
-            self.hide_chart_func(self.id)
-            return
-        self.plot_chart_func(self.id, *self.get_params())
-
-    def plot_or_hide_chart(self):
-        if self.plot_btn.text() == 'Plot':
-            if not self.validate_user_input():
-                return
-            self.plot_btn.setText('Hide')
-            self.plot_btn.setStyleSheet('border: 3px solid black;border-radius:5px;background-color:#ff5500')
-            self.plot_chart_func(self.id, *self.get_params())
-        else:
-            self.plot_btn.setText('Plot')
-            self.plot_btn.setStyleSheet('border: 3px solid black;border-radius:5px;background-color:#00aa00')
-            self.hide_chart_func(self.id)
-
-    def change_color(self):
-        color = QColorDialog.getColor()
-        if color.isValid():
-            self.color = color.getRgb()[:3]
-            self.color_btn.setStyleSheet(f'border:3px solid black;border-radius:5px;background-color:rgb{self.color};')
-            self.redraw_chart()
+class DataWidget(EntryWidget, DataForm):
+    def _initUI(self):
+        self.setupUi(self)
+        self.name_label.setText(self.entry.name)
+        self.name_label.setToolTip(self.entry.path)
+        self.show_points_checkbox.setChecked(self.entry.show_points)
+        self.show_lines_checkbox.setChecked(self.entry.show_lines)
+        self.show_faces_checkbox.setChecked(self.entry.show_faces)
+        self.show_color()
+        self.show_state()
+        self.plot_btn.clicked.connect(self.plot_or_hide_chart)
+        self.delete_btn.clicked.connect(partial(self.del_chart_func, self.entry))
+        self.color_btn.clicked.connect(self.change_color)
+        self.show_points_checkbox.stateChanged.connect(self.redraw_chart)
+        self.show_lines_checkbox.stateChanged.connect(self.redraw_chart)
+        self.show_faces_checkbox.stateChanged.connect(self.redraw_chart)
 
 
-class ParamWidget(QWidget):
+class ParamWidget(QWidget, ParamForm):
     def __init__(self, name, change_param_func, del_param_func):
         super().__init__()
         self.name = name
@@ -141,7 +304,7 @@ class ParamWidget(QWidget):
         self.change()
 
     def _initUI(self):
-        uic.loadUi('res/param_widget.ui', self)
+        self.setupUi(self)
         self.setFixedHeight(115)
         self.name_label.setText(f'Parameter {self.name}')
         self.min_val_spin_box.setButtonSymbols(QAbstractSpinBox.NoButtons)
@@ -179,10 +342,14 @@ class MainWindow(QWidget):
     def __init__(self, queue):
         super().__init__()
         self.queue = queue
+        self.shared_arrays = SharedArrayWriter()
+        self.open_entries = set()
+        # Edits and parameter values waiting for the redraw timer
+        self.pending_entries = set()
+        self.pending_params = {}
         self._initUI()
         self.next_chart_id = 0
         self.load_default_charts()
-        self.resize_chart_list()
         self.resize_param_list()
 
     def _initUI(self):
@@ -192,15 +359,27 @@ class MainWindow(QWidget):
         self.setMinimumHeight(400)
         self.layout = QVBoxLayout(self)
 
-        self.charts_group_box = QGroupBox('Charts')
-        self.charts_group_box.setStyleSheet('border: none;')
-        self.chart_list = QVBoxLayout()
-        self.chart_list.setSpacing(0)
-        self.charts_group_box.setLayout(self.chart_list)
-        self.functions_scroll = QScrollArea()
-        self.functions_scroll.setWidget(self.charts_group_box)
-        self.functions_scroll.setWidgetResizable(True)
-        self.layout.addWidget(self.functions_scroll)
+        # Started by the first edit and not restarted by the next ones, so a slider
+        # drag or typing sends one batch every GUI_REDRAW_DELAY ms at most
+        self.redraw_timer = QTimer(self)
+        self.redraw_timer.setSingleShot(True)
+        self.redraw_timer.setInterval(GUI_REDRAW_DELAY)
+        self.redraw_timer.timeout.connect(self.flush_redraws)
+
+        # Only the charts on the screen have widgets, so the time to start and the
+        # memory taken do not grow with the number of charts
+        self.chart_model = ChartListModel()
+        self.chart_view = QListView()
+        self.chart_view.setModel(self.chart_model)
+        self.chart_view.setItemDelegate(ChartDelegate(self))
+        self.chart_view.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.chart_view.setSelectionMode(QAbstractItemView.NoSelection)
+        self.chart_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.chart_view.setStyleSheet('border: none;')
+        self.chart_view.verticalScrollBar().valueChanged.connect(self.update_chart_widgets)
+        self.chart_model.rowsInserted.connect(self.relayout_chart_widgets)
+        self.chart_model.rowsRemoved.connect(self.relayout_chart_widgets)
+        self.layout.addWidget(self.chart_view)
 
         self.add_chart_btn = QPushButton('New chart', self)
         self.add_chart_btn.setFont(QFont('Arial', 14))
@@ -212,8 +391,30 @@ class MainWindow(QWidget):
                                             border: 2px solid;
                                             border-radius: 10px;
                                             ''')
+        self.play_btn = QPushButton('Play', self)
+        self.play_btn.setFont(QFont('Arial', 14))
+        self.play_btn.clicked.connect(self.toggle_playback)
+        self.play_btn.setFixedWidth(150)
+        self.play_btn.setFixedHeight(40)
+        self.play_btn.setStyleSheet('''background: none;
+                                       background-color: rgb(255, 255, 255);
+                                       border: 2px solid;
+                                       border-radius: 10px;
+                                       ''')
+        self.open_data_btn = QPushButton('Open data', self)
+        self.open_data_btn.setFont(QFont('Arial', 14))
+        self.open_data_btn.clicked.connect(self.open_data_file)
+        self.open_data_btn.setFixedWidth(150)
+        self.open_data_btn.setFixedHeight(40)
+        self.open_data_btn.setStyleSheet('''background: none;
+                                            background-color: rgb(255, 255, 255);
+                                            border: 2px solid;
+                                            border-radius: 10px;
+                                            ''')
         self.button_layout_1 = QHBoxLayout()
         self.button_layout_1.addWidget(self.add_chart_btn)
+        self.button_layout_1.addWidget(self.play_btn)
+        self.button_layout_1.addWidget(self.open_data_btn)
         self.layout.addLayout(self.button_layout_1)
 
         self.params_group_box = QGroupBox('Parameters')
@@ -242,49 +443,172 @@ class MainWindow(QWidget):
         self.layout.addLayout(self.button_layout_2)
 
     def load_default_charts(self):
-        for func, x_from, x_to, y_from, y_to, x_step, y_step, scale in DEFAULT_CHARTS:
-            chart_widget = ChartWidget(self.next_chart_id, self.plot_chart, self.hide_chart, self.del_chart)
-            chart_widget.set_params(func, x_from, x_to, y_from, y_to, x_step, y_step, scale)
-            self.chart_list.addWidget(chart_widget)
+        entries = []
+        for chart in DEFAULT_CHARTS:
+            entries.append(ChartEntry(self.next_chart_id, *chart))
             self.next_chart_id += 1
-
-    def resize_chart_list(self):
-        self.charts_group_box.setFixedHeight(self.chart_list.count() * 180 + 40)
+        self.chart_model.append(entries)
+
+    def update_chart_widgets(self):
+        # Opens the widgets of the rows that came into view and closes the others
+        view, model = self.chart_view, self.chart_model
+        first = view.indexAt(QPoint(0, 0)).row()
+        last = view.indexAt(QPoint(0, view.viewport().height() - 1)).row()
+        if last < 0:
+            last = model.rowCount() - 1
+        visible = set(model.entries[first:last + 1]) if first >= 0 else set()
+        for entry in self.open_entries - visible:
+            view.closePersistentEditor(model.index(model.entries.index(entry)))
+        for entry in visible - self.open_entries:
+            view.openPersistentEditor(model.index(model.entries.index(entry)))
+        self.open_entries = visible
+
+    def relayout_chart_widgets(self):
+        # The view lays the rows out lazily, so indexAt would still see the old rows
+        self.chart_view.doItemsLayout()
+        self.update_chart_widgets()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_chart_widgets()
 
     def resize_param_list(self):
         self.params_group_box.setFixedHeight(self.param_list.count() * 115 + 17)
 
     def add_chart(self):
-        chart_widget = ChartWidget(self.next_chart_id, self.plot_chart, self.hide_chart, self.del_chart)
-        self.chart_list.addWidget(chart_widget)
-        self.resize_chart_list()
+        self.chart_model.append([ChartEntry(self.next_chart_id)])
+        self.chart_view.scrollToBottom()
         self.next_chart_id += 1
 
-    def plot_chart(self, *chart_data):
-        self.queue.put([Signals.show_chart, *chart_data])
+    def schedule_redraw(self, entry):
+        self.pending_entries.add(entry)
+        if not self.redraw_timer.isActive():
+            self.redraw_timer.start()
+
+    def flush_redraws(self):
+        # The latest value of every changed parameter, then one redraw for each
+        # plotted chart that was edited or whose formula uses one of them
+        params, entries = self.pending_params, self.pending_entries
+        self.pending_params, self.pending_entries = {}, set()
+        for param_data in params.items():
+            self.queue.put([Signals.add_param, *param_data])
+        for entry in self.chart_model.entries:
+            if entry.plotted and (entry in entries or params and entry.get_param_names() & params.keys()):
+                self.redraw_chart(entry)
+
+    def redraw_chart(self, entry):
+        if not entry.plotted:
+            return
+        if entry.validate():
+            self.hide_chart(entry.id)
+            return
+        self.queue.put(entry.redraw_signal())
+
+    def plot_or_hide_chart(self, entry):
+        self.pending_entries.discard(entry)
+        if not entry.plotted:
+            entry.error = entry.validate()
+            if entry.error:
+                return
+            entry.plotted = True
+            self.plot_chart(entry)
+        else:
+            entry.plotted = False
+            self.hide_chart(entry.id)
+
+    def toggle_playback(self):
+        playing = self.play_btn.text() == 'Play'
+        self.play_btn.setText('Pause' if playing else 'Play')
+        self.queue.put([Signals.play, playing])
+
+    def plot_chart(self, entry):
+        self.queue.put(entry.signal())
 
     def hide_chart(self, chart_id):
         self.queue.put([Signals.del_chart, chart_id])
 
-    def del_chart(self, chart_widget):
-        self.queue.put([Signals.del_chart, chart_widget.get_id()])
-        chart_widget.close()
-        self.chart_list.removeWidget(chart_widget)
-        self.resize_chart_list()
+    def plot_data(self, name, vertices, color=(255, 255, 255), show_points=False, show_lines=True,
+                  show_faces=False):
+        # Shares an (n, m, 3) grid of vertices with the plotter and lists it with
+        # the charts, returns its chart id
+        entry = DataEntry(self.next_chart_id, name)
+        self.next_chart_id += 1
+        entry.handle, shared = self.shared_arrays.allocate(entry.id, np.shape(vertices))
+        shared[...] = vertices
+        return self.add_data_entry(entry, color, show_points, show_lines, show_faces)
+
+    def open_data_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, 'Open data file', '',
+                                              'Grids (*.npy *.npz *.raw *.bin *.dat);;'
+                                              'Text grids (*.csv *.txt);;All files (*)')
+        if not path:
+            return
+        row_length, dtype = None, 'float32'
+        suffix = os.path.splitext(path)[1].lower()
+        if suffix in ('.csv', '.txt'):
+            # Small enough to read here and hand over through shared memory
+            try:
+                vertices = read_text_grid(path)
+            except (OSError, ValueError) as err:
+                print("Error:", err)
+                return
+            self.plot_data(path, vertices)
+            return
+        if suffix not in ('.npy', '.npz'):
+            text, ok = QInputDialog.getText(self, 'Raw data layout', 'Row length and value type:',
+                                            text='1024 float32')
+            try:
+                row_length, dtype = text.split()
+                row_length = int(row_length)
+                np.dtype(dtype)
+            except (ValueError, TypeError):
+                return
+            if not ok or row_length <= 0:
+                return
+        self.plot_file(path, row_length, dtype)
+
+    def plot_file(self, path, row_length=None, dtype='float32', color=(255, 255, 255),
+                  show_points=False, show_lines=True, show_faces=False):
+        # Asks the plotter to map a data file and lists it with the charts,
+        # returns its chart id
+        entry = DataEntry(self.next_chart_id, path, row_length, dtype)
+        self.next_chart_id += 1
+        return self.add_data_entry(entry, color, show_points, show_lines, show_faces)
+
+    def add_data_entry(self, entry, color, show_points, show_lines, show_faces):
+        entry.color, entry.show_points, entry.show_lines, entry.show_faces = color, show_points, show_lines, show_faces
+        self.chart_model.append([entry])
+        self.chart_view.scrollToBottom()
+        self.plot_chart(entry)
+        return entry.id
+
+    def del_chart(self, entry):
+        self.queue.put([Signals.del_chart, entry.get_id()])
+        self.shared_arrays.release(entry.get_id())
+        self.pending_entries.discard(entry)
+        if entry in self.open_entries:
+            self.open_entries.discard(entry)
+            self.chart_view.closePersistentEditor(self.chart_model.index(self.chart_model.entries.index(entry)))
+        self.chart_model.remove(entry)
 
     def add_param(self):
         param_name, ok = QInputDialog.getText(self, 'Parameter name input', 'Enter parameter name:')
+        if ok and param_name in (TIME, *ARGUMENTS, *NAMESPACE):
+            # Formulas always read these names as their own, never as parameters
+            print("Error:", f"'{param_name}' is a reserved name")
+            return
         if ok and param_name and not param_name[0].isdigit():
             param_widget = ParamWidget(param_name, self.change_param, self.del_param)
             self.param_list.addWidget(param_widget)
             self.resize_param_list()
 
-    def change_param(self, *param_data):
-        self.queue.put([Signals.add_param, *param_data])
-        for i in range(self.chart_list.count()):
-            self.chart_list.itemAt(i).widget().redraw_chart()
+    def change_param(self, name, value):
+        self.pending_params[name] = value
+        if not self.redraw_timer.isActive():
+            self.redraw_timer.start()
 
     def del_param(self, param_widget):
+        self.pending_params.pop(param_widget.get_name(), None)
         self.queue.put([Signals.del_param, param_widget.get_name()])
         param_widget.close()
         self.param_list.removeWidget(param_widget)
@@ -292,6 +616,7 @@ class MainWindow(QWidget):
 
     def closeEvent(self, _):
         self.queue.put([Signals.stop_execution])
+        self.shared_arrays.release_all()
 
 
 def start_gui(queue):
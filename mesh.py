@@ -0,0 +1,338 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+import os
+
+import numpy as np
+
+from config import INF, LATTICE_TOLERANCE, LOD_MIN_SIDE, JUMP_RATIO, JUMP_MEDIAN_RATIO, JUMP_SAMPLE, \
+    EVAL_WORKERS, EVAL_TILE_NODES, COMPACT_MESH_NODES
+
+# The tile pool, shared by the mesh workers and the animation threads
+evaluator = None
+evaluator_lock = Lock()
+
+
+class MeshCancelled(Exception):
+    pass
+
+
+class Mesh:
+    # edges, if given, is the (edges, joined) pair find_edges would return
+    def __init__(self, x, y, z, edges=None):
+        self._set_vertices(np.stack((x, y, z), axis=-1), edges)
+
+    @classmethod
+    def from_vertices(cls, vertices):
+        # Wraps an (n, m, 3) float64 array without copying it
+        mesh = cls.__new__(cls)
+        mesh._set_vertices(vertices)
+        return mesh
+
+    def _set_vertices(self, vertices, edges=None):
+        self.vertices = vertices.astype(np.float64, copy=False)
+        self.X, self.Y, self.Z = self.vertices.transpose(2, 0, 1)
+        self.edges, self.joined = find_edges(self.Z) if edges is None else edges
+        self._faces = None
+        self.func_key = None
+        self.x_axis = self.y_axis = self.values = None
+        self.levels = []
+
+    @property
+    def shape(self):
+        return self.Z.shape
+
+    @property
+    def size(self):
+        return self.Z.size
+
+    @property
+    def faces(self):
+        # Only filled charts need them, so they are found on first use
+        if self._faces is None:
+            self._faces = find_faces(self.vertices)
+        return self._faces
+
+    def sample(self, rows, cols):
+        grid = np.ix_(rows, cols)
+        return Mesh(self.X[grid], self.Y[grid], self.Z[grid])
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty((0, 0)), np.empty((0, 0)), np.empty((0, 0)))
+
+
+class CompactMesh(Mesh):
+    # A regular grid kept as its two axes and float32 heights, a sixth of the
+    # vertices of a Mesh, and the first node of every edge only: row edges end
+    # one node before their start, column edges one row before. X, Y, vertices
+    # and edges are only built when asked for. edges, if given, is the
+    # (starts, row_edges, joined) triple.
+    def __init__(self, x, y, z, edges=None):
+        self.x = x
+        self.y = y
+        self.Z = z.astype(np.float32, copy=False)
+        if edges is None:
+            edges, self.joined = find_edges(self.Z)
+            self.starts = edges[:, 0].copy()
+            self.row_edges = np.count_nonzero(edges[:, 1] == edges[:, 0] - 1)
+        else:
+            self.starts, self.row_edges, self.joined = edges
+        self._faces = None
+        self.func_key = None
+        self.x_axis = self.y_axis = self.values = None
+        self.levels = []
+
+    @property
+    def X(self):
+        return np.broadcast_to(self.x, self.shape)
+
+    @property
+    def Y(self):
+        return np.broadcast_to(self.y[:, None], self.shape)
+
+    @property
+    def vertices(self):
+        return np.stack((self.X, self.Y, self.Z), axis=-1).astype(np.float64)
+
+    @property
+    def edges(self):
+        ends = self.starts - 1
+        ends[self.row_edges:] -= self.shape[1] - 1
+        return np.stack((self.starts, ends), axis=-1)
+
+    def sample(self, rows, cols):
+        return CompactMesh(self.x[cols], self.y[rows], self.Z[np.ix_(rows, cols)])
+
+
+def build_mesh(func, x_begin, x_end, y_begin, y_end, x_step, y_step, scale=1,
+               previous=None, cancelled=None, compact=None):
+    # compact builds a CompactMesh, by default for grids of COMPACT_MESH_NODES and more
+    x_axis, y_axis = mesh_axes(x_begin, x_end, y_begin, y_end, x_step, y_step)
+    if compact is None:
+        compact = len(x_axis) * len(y_axis) >= COMPACT_MESH_NODES
+    func_key = getattr(func, 'key', None)
+    # The float32 values of a compact mesh are too coarse to reuse in a full precision one
+    if previous is not None and func_key is not None and previous.func_key == func_key and \
+            (compact or previous.values.dtype == np.float64):
+        values = reevaluate(func, x_axis, y_axis, previous, cancelled)
+    else:
+        out = np.empty((len(y_axis), len(x_axis)), dtype=np.float32) if compact else None
+        values = evaluate(func, x_axis, y_axis, cancelled, out=out)
+    if cancelled is not None and cancelled.is_set():
+        raise MeshCancelled
+    if compact:
+        # Unscaled heights are shared with the mesh when the scale is 1
+        values = values.astype(np.float32, copy=False)
+        Z = values * np.float32(scale) if scale != 1 else values
+        Z[np.abs(Z) > INF] = np.nan
+        mesh = CompactMesh(x_axis * scale, y_axis * scale, Z)
+    else:
+        X, Y = np.meshgrid(x_axis, y_axis)
+        Z = values * scale
+        Z[np.abs(Z) > INF] = np.nan
+        mesh = Mesh(X * scale, Y * scale, Z)
+    mesh.func_key = func_key
+    mesh.x_axis, mesh.y_axis, mesh.values = x_axis, y_axis, values
+    mesh.levels = build_levels(mesh)
+    return mesh
+
+
+def build_frame(func, vertices, x_axis, y_axis, time, scale=1):
+    # One frame of an animated chart, written into preallocated (n, m, 3) vertices
+    # whose x and y are already set
+    Z = vertices[..., 2]
+    evaluate(func.at(time), x_axis, y_axis, out=Z)
+    Z *= scale
+    Z[np.abs(Z) > INF] = np.nan
+    mesh = Mesh.from_vertices(vertices)
+    mesh.levels = build_levels(mesh)
+    return mesh
+
+
+def mesh_axes(x_begin, x_end, y_begin, y_end, x_step, y_step):
+    x_axis = np.linspace(x_begin, x_end, round((x_end-x_begin) / x_step) + 1, dtype=np.float64)
+    y_axis = np.linspace(y_begin, y_end, round((y_end-y_begin) / y_step) + 1, dtype=np.float64)
+    return x_axis, y_axis
+
+
+def evaluate(func, x_axis, y_axis, cancelled=None, out=None):
+    # func over the grid of the axes, in tiles of whole rows and about EVAL_TILE_NODES
+    # nodes run on a thread pool (NumPy releases the GIL) and written into one array.
+    # The temporaries of the expression only live as long as a tile, so they stay in
+    # cache and the memory they take does not grow with the grid.
+    values = np.empty((len(y_axis), len(x_axis))) if out is None else out
+    if hasattr(func, 'prepare'):
+        evaluate_rows = func.prepare(x_axis, y_axis)
+    else:
+        evaluate_rows = partial(grid_rows, func, x_axis, y_axis)
+    rows = max(EVAL_TILE_NODES // max(len(x_axis), 1), 1)
+    tiles = [(begin, min(begin + rows, len(y_axis))) for begin in range(0, len(y_axis), rows)]
+    if len(tiles) == 1:
+        evaluate_tile(evaluate_rows, values, *tiles[0], cancelled)
+    elif tiles:
+        pool = get_evaluator()
+        # NumPy error handling is set per thread, the pool follows the caller's
+        errors = np.geterr()
+        futures = [pool.submit(evaluate_tile, evaluate_rows, values, begin, end, cancelled, errors)
+                   for begin, end in tiles]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    if cancelled is not None and cancelled.is_set():
+        raise MeshCancelled
+    return values
+
+
+def get_evaluator():
+    global evaluator
+    with evaluator_lock:
+        if evaluator is None:
+            evaluator = ThreadPoolExecutor(EVAL_WORKERS or os.cpu_count())
+        return evaluator
+
+
+def evaluate_tile(evaluate_rows, values, begin, end, cancelled=None, errors=None):
+    if cancelled is None or not cancelled.is_set():
+        with np.errstate(**(errors or {})):
+            values[begin:end] = evaluate_rows(begin, end)
+
+
+def grid_rows(func, x_axis, y_axis, begin, end):
+    return func(*np.meshgrid(x_axis, y_axis[begin:end]))
+
+
+def build_data_mesh(vertices, cancelled=None):
+    mesh = Mesh.from_vertices(vertices)
+    if cancelled is not None and cancelled.is_set():
+        raise MeshCancelled
+    mesh.levels = build_levels(mesh)
+    return mesh
+
+
+def build_levels(mesh):
+    # Level of detail pyramid: the grid decimated by 2, 4, 8... keeping the border nodes
+    levels = []
+    n, m = mesh.shape
+    factor = 2
+    while min(n, m) // factor >= LOD_MIN_SIDE:
+        levels.append(mesh.sample(decimate(n, factor), decimate(m, factor)))
+        factor *= 2
+    return levels
+
+
+def decimate(n, factor):
+    return np.unique(np.append(np.arange(0, n, factor), n - 1))
+
+
+def reevaluate(func, x_axis, y_axis, previous, cancelled=None):
+    # Nodes that lie on the previous lattice keep their values, only the rest is evaluated
+    cols = match_lattice(x_axis, previous.x_axis)
+    rows = match_lattice(y_axis, previous.y_axis)
+    old_cols = cols >= 0
+    old_rows = rows >= 0
+    if old_cols.all() and old_rows.all() and is_slice(cols) and is_slice(rows):
+        return previous.values[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1]
+    values = np.empty((len(y_axis), len(x_axis)))
+    if old_rows.any() and old_cols.any():
+        values[np.ix_(old_rows, old_cols)] = previous.values[np.ix_(rows[old_rows], cols[old_cols])]
+    if not old_rows.all():
+        values[~old_rows] = evaluate(func, x_axis, y_axis[~old_rows], cancelled)
+    if old_rows.any() and not old_cols.all():
+        values[np.ix_(old_rows, ~old_cols)] = evaluate(func, x_axis[~old_cols], y_axis[old_rows], cancelled)
+    return values
+
+
+def match_lattice(axis, old_axis):
+    # Index of the old node every node of axis coincides with, or -1
+    if len(axis) < 2 or len(old_axis) < 2:
+        return np.full(len(axis), -1)
+    right = np.clip(np.searchsorted(old_axis, axis), 1, len(old_axis) - 1)
+    left = right - 1
+    nearest = np.where(axis - old_axis[left] < old_axis[right] - axis, left, right)
+    tolerance = LATTICE_TOLERANCE * (axis[1] - axis[0])
+    return np.where(np.abs(old_axis[nearest] - axis) <= tolerance, nearest, -1)
+
+
+def is_slice(indices):
+    return len(indices) < 2 or (np.diff(indices) == 1).all()
+
+
+def find_edges(z):
+    # Segments between neighbouring valid nodes as (from, to) flat vertex indices,
+    # skipping NaN nodes and jumps. Every row, then every column, is walked from its
+    # last node back to the first: pygame's rasterization depends on the segment
+    # direction, and this order keeps the picture stable. joined marks segments
+    # starting where the previous one ended.
+    index = np.arange(z.size, dtype=np.int32).reshape(z.shape)
+    edges = np.concatenate((
+        line_edges(z[:, ::-1], index[:, ::-1]),
+        line_edges(z.T[:, ::-1], index.T[:, ::-1])
+    ))
+    joined = np.zeros(len(edges), dtype=bool)
+    joined[1:] = edges[1:, 0] == edges[:-1, 1]
+    return edges, joined
+
+
+def line_edges(z, index):
+    mask = line_mask(z)
+    return np.stack((index[:, :-1][mask], index[:, 1:][mask]), axis=-1)
+
+
+def line_mask(z):
+    valid = ~np.isnan(z)
+    return valid[:, :-1] & valid[:, 1:] & ~find_jumps(z)
+
+
+def find_faces(vertices):
+    # Quads whose four sides are all drawn as edges, as (n, 4) flat vertex indices
+    # going around the quad, and their unit normals
+    z = vertices[..., 2]
+    rows = line_mask(z)
+    cols = line_mask(z.T).T
+    mask = rows[:-1] & rows[1:] & cols[:, :-1] & cols[:, 1:]
+    index = np.arange(z.size, dtype=np.int32).reshape(z.shape)
+    faces = np.stack((index[:-1, :-1][mask], index[:-1, 1:][mask],
+                      index[1:, 1:][mask], index[1:, :-1][mask]), axis=-1)
+    return faces, quad_normals(vertices.reshape(-1, 3)[faces])
+
+
+def quad_normals(corners):
+    # Unit normals of (n, 4, 3) quads, from the cross product of their diagonals
+    normals = np.cross(corners[:, 2] - corners[:, 0], corners[:, 3] - corners[:, 1])
+    with np.errstate(invalid='ignore'):
+        normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.nan_to_num(normals)
+
+
+def find_jumps(z):
+    # A segment crossing a pole (x/y, tan...) goes against the slope on both of its
+    # sides, is steeper than both neighbours, and the neighbours themselves steepen
+    # towards it. A coarsely sampled oscillation can pass these tests too, so the
+    # segment must also be JUMP_MEDIAN_RATIO times longer than the median segment.
+    deltas = np.diff(z, axis=1)
+    neighbours = [shift(deltas, k) for k in (1, -1, 2, -2)]
+    prev, next_, prev_2, next_2 = [np.abs(delta) for delta in neighbours]
+    # A sample of the segments is enough for the median
+    sample = np.abs(deltas).ravel()[::max(deltas.size // JUMP_SAMPLE, 1)]
+    sample = sample[~np.isnan(sample)]
+    typical = np.median(sample) if len(sample) else 0
+    with np.errstate(invalid='ignore'):
+        jumps = np.abs(deltas) > JUMP_MEDIAN_RATIO * typical
+        jumps &= (neighbours[0] * deltas < 0) & (neighbours[1] * deltas < 0)
+        jumps &= np.abs(deltas) > JUMP_RATIO * np.maximum(prev, next_)
+        jumps &= ~(prev < prev_2) & ~(next_ < next_2)
+    return jumps
+
+
+def shift(a, k):
+    shifted = np.full_like(a, np.nan)
+    if k > 0:
+        shifted[:, k:] = a[:, :-k]
+    else:
+        shifted[:, :k] = a[:, -k:]
+    return shifted
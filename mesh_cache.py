@@ -0,0 +1,226 @@
+import hashlib
+import os
+from collections import OrderedDict
+from threading import Condition, Lock, Thread
+from time import monotonic, time
+
+import numpy as np
+
+from adaptive import AdaptiveMesh
+from config import MESH_CACHE_DIR, MESH_CACHE_ENTRIES, MESH_CACHE_SIZE, MESH_CACHE_WRITE_DELAY, MESH_CACHE_FORMAT, \
+    MESH_CACHE_STALE_AGE, \
+    INF, COMPACT_MESH_NODES, JUMP_RATIO, JUMP_MEDIAN_RATIO, JUMP_SAMPLE, LOD_MIN_SIDE, ADAPTIVE_BASE_SIDE, \
+    ADAPTIVE_TOLERANCE, ADAPTIVE_BUDGET
+from mesh import CompactMesh, Mesh
+
+# Part of every key: files saved with another layout or with other settings that
+# shape the mesh are never found, and are evicted in time
+MESH_VERSION = (MESH_CACHE_FORMAT, INF, COMPACT_MESH_NODES, JUMP_RATIO, JUMP_MEDIAN_RATIO, JUMP_SAMPLE,
+                LOD_MIN_SIDE, ADAPTIVE_BASE_SIDE, ADAPTIVE_TOLERANCE, ADAPTIVE_BUDGET)
+
+
+class MeshCache:
+    # Built meshes by the hash of everything they are built from: the formula with
+    # its parameter values, the bounds, steps and scale. The last MESH_CACHE_ENTRIES
+    # are kept in memory, and meshes are saved to directory as uncompressed .npz
+    # files of their heights and edges, the least recently used files being
+    # removed past max_bytes. Worker threads share it.
+    def __init__(self, directory=MESH_CACHE_DIR, entries=MESH_CACHE_ENTRIES, max_bytes=MESH_CACHE_SIZE,
+                 write_delay=MESH_CACHE_WRITE_DELAY):
+        self.directory = directory
+        self.entries = entries
+        self.max_bytes = max_bytes
+        self.write_delay = write_delay
+        self.meshes = OrderedDict()
+        # Chart key: (key, mesh, time due) of the mesh waiting to be saved
+        self.pending = {}
+        self.writing = False
+        self.writer = None
+        self.lock = Lock()
+        self.changed = Condition(self.lock)
+
+    def key(self, func, mesh_params, adaptive=False):
+        # None for functions without a key, which are not cached. The key is the
+        # chart key, the hash of MESH_VERSION and the formula with its bounds,
+        # steps and scale, followed by the hash of the parameter values and time.
+        func_key = getattr(func, 'key', None)
+        if func_key is None:
+            return None
+        text, *values = func_key
+        chart = hashlib.sha1(repr((MESH_VERSION, text, tuple(mesh_params), adaptive)).encode()).hexdigest()
+        return chart + '-' + hashlib.sha1(repr(values).encode()).hexdigest()
+
+    def build(self, key, build, func, *args, **kwargs):
+        mesh = self.get(key, func.key)
+        if mesh is None:
+            mesh = build(func, *args, **kwargs)
+            self.put(key, mesh)
+        return mesh
+
+    def get(self, key, func_key=None):
+        # func_key is given back to meshes read from disk, so that the next mesh
+        # of the same function reuses their values
+        with self.lock:
+            if key in self.meshes:
+                self.meshes.move_to_end(key)
+                return self.meshes[key]
+        path = self._path(key)
+        try:
+            with np.load(path) as arrays:
+                mesh = restore_mesh(arrays)
+            os.utime(path)
+            if mesh.values is not None:
+                mesh.func_key = func_key
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as err:
+            print("Error:", err)
+            return None
+        self._remember(key, mesh)
+        return mesh
+
+    def put(self, key, mesh):
+        # The mesh is saved by the writer thread after write_delay, unless another
+        # mesh of the same chart comes first: moving a slider saves only the
+        # state it stops at
+        self._remember(key, mesh)
+        with self.changed:
+            self.pending[key.partition('-')[0]] = key, mesh, monotonic() + self.write_delay
+            if self.writer is None:
+                self.writer = Thread(target=self._write_loop, daemon=True)
+                self.writer.start()
+            self.changed.notify_all()
+
+    def flush(self):
+        # Saves the meshes still waiting and waits for the writes, at exit
+        with self.changed:
+            self.pending = {chart: (key, mesh, 0) for chart, (key, mesh, _) in self.pending.items()}
+            self.changed.notify_all()
+            while self.pending or self.writing:
+                self.changed.wait()
+
+    def _write_loop(self):
+        while True:
+            with self.changed:
+                while True:
+                    due = min(((due, chart) for chart, (_, _, due) in self.pending.items()), default=None)
+                    if due is not None and due[0] <= monotonic():
+                        break
+                    self.changed.wait(None if due is None else due[0] - monotonic())
+                key, mesh, _ = self.pending.pop(due[1])
+                self.writing = True
+            try:
+                self._write(key, mesh)
+            finally:
+                with self.changed:
+                    self.writing = False
+                    self.changed.notify_all()
+
+    def _write(self, key, mesh):
+        path = self._path(key)
+        # Written under a temporary name, so a file that is there is always whole
+        partial = f'{path}.{os.getpid()}.{id(mesh)}.tmp'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(partial, 'wb') as file:
+                np.savez(file, **mesh_arrays(mesh))
+            os.replace(partial, path)
+        except OSError as err:
+            print("Error:", err)
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def _remember(self, key, mesh):
+        with self.lock:
+            self.meshes[key] = mesh
+            self.meshes.move_to_end(key)
+            while len(self.meshes) > self.entries:
+                self.meshes.popitem(last=False)
+
+    def _evict(self):
+        # Temporary files left by a process that stopped while writing are removed
+        # once they are MESH_CACHE_STALE_AGE seconds old
+        stale = time() - MESH_CACHE_STALE_AGE
+        with self.lock:
+            files = []
+            try:
+                entries = list(os.scandir(self.directory))
+            except OSError:
+                return
+            for entry in entries:
+                stat = entry.stat()
+                if entry.name.endswith('.npz'):
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                elif entry.name.endswith('.tmp') and stat.st_mtime < stale:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+def mesh_arrays(mesh):
+    # The mesh and its levels of detail as flat arrays, k_name for level k
+    if isinstance(mesh, CompactMesh):
+        kind = 'compact'
+    elif isinstance(mesh, AdaptiveMesh):
+        kind = 'adaptive'
+    else:
+        kind = 'grid'
+    arrays = {'kind': np.array(kind), 'levels': np.array(len(mesh.levels) + 1)}
+    for k, level in enumerate((mesh, *mesh.levels)):
+        if kind == 'compact':
+            fields = {'x': level.x, 'y': level.y, 'z': level.Z, 'starts': level.starts,
+                      'row_edges': np.array(level.row_edges), 'joined': level.joined}
+        elif kind == 'adaptive':
+            fields = {'vertices': level.vertices, 'edges': level.edges, 'quads': level.quads,
+                      'evaluations': np.array(level.evaluations)}
+        else:
+            # Meshes of formulas are regular grids, kept as their axes
+            fields = {'x': level.X[0], 'y': level.Y[:, 0], 'z': level.Z, 'edges': level.edges,
+                      'joined': level.joined}
+        arrays.update((f'{k}_{name}', array) for name, array in fields.items())
+    if mesh.values is not None:
+        # The sampled axes and values of the top level, reused by the next mesh
+        arrays.update(x_axis=mesh.x_axis, y_axis=mesh.y_axis)
+        if mesh.values is not mesh.Z:
+            arrays['values'] = mesh.values
+    return arrays
+
+
+def restore_mesh(arrays):
+    kind = str(arrays['kind'])
+    levels = []
+    for k in range(int(arrays['levels'])):
+        fields = {name[len(f'{k}_'):]: arrays[name] for name in arrays.files if name.startswith(f'{k}_')}
+        if kind == 'compact':
+            level = CompactMesh(fields['x'], fields['y'], fields['z'],
+                                edges=(fields['starts'], int(fields['row_edges']), fields['joined']))
+        elif kind == 'adaptive':
+            level = AdaptiveMesh(fields['vertices'], fields['edges'], fields['quads'])
+            level.evaluations = int(fields['evaluations'])
+        else:
+            X, Y = np.meshgrid(fields['x'], fields['y'])
+            level = Mesh(X, Y, fields['z'], edges=(fields['edges'], fields['joined']))
+        levels.append(level)
+    mesh = levels[0]
+    mesh.levels = levels[1:]
+    if 'x_axis' in arrays.files:
+        mesh.x_axis, mesh.y_axis = arrays['x_axis'], arrays['y_axis']
+        # Compact meshes of scale 1 share their values with their heights
+        mesh.values = arrays['values'] if 'values' in arrays.files else mesh.Z
+    return mesh
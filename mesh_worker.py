@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import perf_counter
+
+from config import MESH_WORKERS
+from adaptive import build_adaptive_mesh
+from data_files import open_grid_mesh
+from mesh import build_mesh, build_data_mesh, MeshCancelled
+
+
+class MeshWorker:
+    # Meshes are built on worker threads: NumPy releases the GIL inside its kernels,
+    # and the finished arrays are handed back by reference, without any copying.
+    def __init__(self, max_workers=MESH_WORKERS, cache=None):
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.cache = cache
+        self.jobs = {}
+        self.timings = []
+
+    def submit(self, chart_id, func, *mesh_params, previous=None, adaptive=False):
+        if adaptive:
+            build, kwargs = build_adaptive_mesh, {}
+        else:
+            build, kwargs = build_mesh, {'previous': previous}
+        key = None if self.cache is None else self.cache.key(func, mesh_params, adaptive)
+        if key is None:
+            self._start(chart_id, build, func, *mesh_params, **kwargs)
+        else:
+            self._start(chart_id, self.cache.build, key, build, func, *mesh_params, **kwargs)
+
+    def submit_data(self, chart_id, vertices):
+        self._start(chart_id, build_data_mesh, vertices)
+
+    def submit_window(self, chart_id, grid, window):
+        self._start(chart_id, grid.build, window)
+
+    def submit_file(self, chart_id, path, row_length, dtype, matrix, width, height):
+        # The result is the opened MappedGrid, with its first mesh
+        self._start(chart_id, open_grid_mesh, path, row_length, dtype, matrix, width, height)
+
+    def _start(self, chart_id, build, *args, **kwargs):
+        self.cancel(chart_id)
+        cancelled = Event()
+        future = self.executor.submit(self._timed, chart_id, build, *args, **kwargs, cancelled=cancelled)
+        self.jobs[chart_id] = future, cancelled
+
+    def _timed(self, chart_id, build, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return build(*args, **kwargs)
+        finally:
+            self.timings.append((chart_id, start, perf_counter()))
+
+    def take_timings(self):
+        # (chart id, start, end) of the jobs run since the last call
+        timings, self.timings = self.timings, []
+        return timings
+
+    def cancel(self, chart_id):
+        if chart_id in self.jobs:
+            future, cancelled = self.jobs.pop(chart_id)
+            cancelled.set()
+            future.cancel()
+
+    def has_jobs(self):
+        return bool(self.jobs)
+
+    def finished(self):
+        done = [chart_id for chart_id, (future, _) in self.jobs.items() if future.done()]
+        for chart_id in done:
+            future, _ = self.jobs.pop(chart_id)
+            try:
+                yield chart_id, future.result()
+            except MeshCancelled:
+                pass
+            except Exception as err:
+                print("Error:", err)
+                yield chart_id, None
+
+    def shutdown(self):
+        for chart_id in list(self.jobs):
+            self.cancel(chart_id)
+        self.executor.shutdown(wait=False)
+        if self.cache is not None:
+            self.cache.flush()
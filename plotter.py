@@ -1,144 +1,197 @@
 import pygame
 from multiprocessing import Process, Queue
 import numpy as np
-from math import e
 import os
+from time import perf_counter
 
+from adaptive import build_adaptive_mesh
+from animation import FrameRing
 from config import *
-from gui import start_gui
+from data_files import MappedGrid
+from drawing import draw_faces, draw_points, draw_polylines, edge_polylines
+from expressions import compile_expression, normalize
+from mesh import CompactMesh, Mesh, build_mesh
+from mesh_cache import MeshCache
+from mesh_worker import MeshWorker
+from profiler import FrameProfiler, NO_PROFILER
+from shared_arrays import SharedArrayReader
+from signal_queue import SignalQueue
 
 
 class Chart:
     color = 'white'
 
     def __init__(self):
-        self.X = np.empty(0)
-        self.Y = np.empty(0)
-        self.Z = np.empty((0, 0))
-        self.x = np.empty(0)
-        self.y = np.empty(0)
-        self.z = np.empty(0)
         self.zoom_power = 1
         self.h_angle = 0
         self.v_angle = 0
         self.x_bias = 0
         self.y_bias = 0
         self.z_bias = 0
-        self.x_gaps = np.array([0])
-        self.y_gaps = np.array([0])
         self.show_points = False
         self.show_lines = True
+        self.show_faces = False
+        self.dirty = True
+        self.frame_budget = None
+        self.node_cost = LOD_NODE_COST
+        self.face_time = 0
+        self.clear()
 
     def make_chart(self, func, x_begin, x_end, y_begin, y_end, x_step, y_step, scale=1,
-                   color=color, show_points=False, show_lines=True):
+                   color=color, show_points=False, show_lines=True, show_faces=False, compact=None,
+                   adaptive=False):
         try:
-            self.show_points = show_points
-            self.show_lines = show_lines
-            self.color = color
-            self.clear()
-            x_axis = np.linspace(x_begin, x_end, round((x_end-x_begin) / x_step) + 1, dtype=np.float64)
-            y_axis = np.linspace(y_begin, y_end, round((y_end-y_begin) / y_step) + 1, dtype=np.float64)
-            self.X, self.Y = np.meshgrid(x_axis, y_axis)
-            self.Z = func(self.X, self.Y) * scale
-            self.X *= scale
-            self.Y *= scale
-            self.Z[np.abs(self.Z) > INF] = np.nan
-            gaps = np.isnan(self.Z)
-            self.x_gaps = gaps + np.roll(gaps, 1, axis=0)
-            self.y_gaps = gaps + np.roll(gaps, 1, axis=1)
-            self.x_gaps[0,:] = 0
-            self.x_gaps[:,0] = 0
-            self.y_gaps[0,:] = 0
-            self.y_gaps[:,0] = 0
-            self.x_gaps = np.where(self.x_gaps)
-            self.x_gaps = np.reshape(np.concatenate(self.x_gaps), (2, len(self.x_gaps[0])))
-            self.x_gaps = np.concatenate((self.x_gaps, [[0], [0]]), axis=1)
-            self.y_gaps = np.where(self.y_gaps)
-            self.y_gaps = np.reshape(np.concatenate(self.y_gaps), (2, len(self.y_gaps[0])))
-            self.y_gaps = np.concatenate((self.y_gaps, [[0], [0]]), axis=1)
+            self.set_style(color, show_points, show_lines, show_faces)
+            if adaptive:
+                self.set_mesh(build_adaptive_mesh(func, x_begin, x_end, y_begin, y_end, x_step, y_step, scale))
+            else:
+                self.set_mesh(build_mesh(func, x_begin, x_end, y_begin, y_end, x_step, y_step, scale,
+                                         previous=self.mesh, compact=compact))
         except Exception as err:
             self.clear()
             print("Error:", err)
 
     def set_chart(self, x, y, z, color=color):
-        self.X, self.Y, self.Z = x, y, z
+        self.set_mesh(Mesh(x, y, z))
         self.color = color
 
+    def set_style(self, color=color, show_points=False, show_lines=True, show_faces=False):
+        style = (color, show_points, show_lines, show_faces)
+        if style != (self.color, self.show_points, self.show_lines, self.show_faces):
+            self.color = color
+            self.show_points = show_points
+            self.show_lines = show_lines
+            self.show_faces = show_faces
+            self.dirty = True
+
+    def set_mesh(self, mesh):
+        self.mesh = mesh
+        self.level = None
+        self._select_level()
+
+    def set_frame_budget(self, budget):
+        self.frame_budget = budget
+        self._select_level()
+
+    def estimated_cost(self):
+        return self.mesh.size * self.node_cost
+
+    def _select_level(self):
+        level = self.mesh
+        if self.frame_budget is not None:
+            for level in (self.mesh, *self.mesh.levels):
+                if level.size * self.node_cost <= self.frame_budget:
+                    break
+        if level is not self.level:
+            self.level = level
+            self.points = np.empty(level.shape + (2,), dtype=level.Z.dtype)
+            self.depth = None
+            self.dirty = True
+
     def clear(self):
-        self.X = np.empty(0)
-        self.Y = np.empty(0)
-        self.Z = np.empty((0, 0))
+        self.set_mesh(Mesh.empty())
 
     def zoom(self, zoom):
-        self.zoom_power = zoom
-
-    def _zoom(self):
-        self.x *= self.zoom_power
-        self.y *= self.zoom_power
-        self.z *= self.zoom_power
+        if zoom != self.zoom_power:
+            self.zoom_power = zoom
+            self.dirty = True
 
     def rotate(self, h_angle, v_angle):
-        self.h_angle = h_angle
-        self.v_angle = v_angle
-
-    def _rotate(self):
-        x = self.x*np.cos(self.h_angle) - self.y*np.sin(self.h_angle)
-        y = self.x*np.sin(self.h_angle) + self.y*np.cos(self.h_angle)
-        self.x = x
-        self.y = y
-
-        y = self.y*np.cos(self.v_angle) - self.z*np.sin(self.v_angle)
-        self.z = -self.y*np.sin(self.v_angle) + self.z*np.cos(self.v_angle)
-        self.y = y
+        if (h_angle, v_angle) != (self.h_angle, self.v_angle):
+            self.h_angle = h_angle
+            self.v_angle = v_angle
+            self.dirty = True
 
     def move(self, x_bias=0, y_bias=0, z_bias=0):
-        self.x_bias = x_bias
-        self.y_bias = y_bias
-        self.z_bias = z_bias
-
-    def _move(self):
-        self.x += self.x_bias
-        self.y += self.y_bias
-        self.z += self.z_bias
-
-    def render(self, screen):
-        self.x = self.X.copy()
-        self.y = self.Y.copy()
-        self.z = self.Z.copy()
-        self._zoom()
-        self._rotate()
-        self._move()
-        n = self.x.shape[0]
-        m = self.x.shape[1] if len(self.x.shape) > 1 else 0
+        if (x_bias, y_bias, z_bias) != (self.x_bias, self.y_bias, self.z_bias):
+            self.x_bias = x_bias
+            self.y_bias = y_bias
+            self.z_bias = z_bias
+            self.dirty = True
+
+    def view_matrix(self):
+        # Rows map homogeneous (x, y, z, 1) to screen x, screen y and depth:
+        # zoom, rotate around the z axis by h_angle, then around the x axis
+        # by v_angle, then move. The screen y axis points down, hence -z. Depth
+        # grows away from the viewer, perpendicular to both screen axes, and the
+        # view is looked at from above: positive v_angle brings +z closer.
+        s = self.zoom_power
+        sin_h, cos_h = np.sin(self.h_angle), np.cos(self.h_angle)
+        sin_v, cos_v = np.sin(self.v_angle), np.cos(self.v_angle)
+        return np.array([
+            [s*cos_h, -s*sin_h, 0, self.x_bias],
+            [s*sin_h*sin_v, s*cos_h*sin_v, -s*cos_v, -self.z_bias],
+            [-s*sin_h*cos_v, -s*cos_h*cos_v, -s*sin_v, self.y_bias]
+        ])
+
+    def _project(self):
+        matrix = self.view_matrix()
+        if self.show_faces and self.depth is None:
+            self.depth = np.empty(self.level.shape, dtype=self.points.dtype)
+        if isinstance(self.level, CompactMesh):
+            # Each row is a sum of a z term and terms of the x and y axes alone,
+            # so nothing of the size of the grid is allocated
+            level = self.level
+            outputs = (self.points[..., 0], self.points[..., 1], self.depth)
+            for row, out in enumerate(outputs[:3 if self.show_faces else 2]):
+                np.multiply(level.Z, matrix[row, 2], out=out)
+                out += (level.x * matrix[row, 0] + matrix[row, 3]).astype(np.float32)
+                out += (level.y * matrix[row, 1]).astype(np.float32)[:, None]
+            return
+        points = self.points.reshape(-1, 2)
+        np.matmul(self.level.vertices.reshape(-1, 3), matrix[:2, :3].T, out=points)
+        points[:, 0] += matrix[0, 3]
+        points[:, 1] += matrix[1, 3]
+        if self.show_faces:
+            depth = self.depth.reshape(-1)
+            np.matmul(self.level.vertices.reshape(-1, 3), matrix[2, :3], out=depth)
+            depth += matrix[2, 3]
+
+    def project(self):
+        if self.dirty:
+            self._project()
+            self.dirty = False
+
+    def faces(self):
+        # Quads as vertex indices into points, with their mean depth and colour,
+        # shaded by how directly they face the viewer
+        self.project()
+        indices, normals = self.level.faces
+        depth = self.depth.reshape(-1)[indices].mean(axis=1)
+        light = np.abs(normals @ self.view_matrix()[2, :3]) / self.zoom_power
+        shade = FACE_AMBIENT + (1 - FACE_AMBIENT) * light
+        colors = np.outer(shade, pygame.Color(self.color)[:3]).astype(int)
+        return indices, depth, colors
+
+    def render(self, screen, profiler=NO_PROFILER, chart_id=None):
+        start = perf_counter()
+        with profiler.phase('project', chart_id):
+            self.project()
+        if not self.level.size:
+            return
+        profiler.count(chart_id, self.level.size, len(self.level.joined))
+        points = self.points.reshape(-1, 2)
         if self.show_points:
-            for x in range(n):
-                for y in range(m):
-                    pygame.draw.circle(screen, self.color, (self.x[x][y], -self.z[x][y]), 2)
-        if self.show_lines:
-            i = 0
-            j = 0
-            for x in range(1, n):
-                for y in range(1, m):
-                    if self.x_gaps[0][i] == x and self.x_gaps[1][i] == y:
-                        i += 1
-                        if self.y_gaps[0,j] == x and self.y_gaps[1,j] == y:
-                            j += 1
-                            continue
-                        pygame.draw.line(screen, self.color, (self.x[x][y], -self.z[x][y]), (self.x[x][y-1], -self.z[x][y-1]), width=1)
-                        continue
-                    pygame.draw.line(screen, self.color, (self.x[x][y], -self.z[x][y]), (self.x[x-1][y], -self.z[x-1][y]), width=1)
-                    if self.y_gaps[0,j] == x and self.y_gaps[1,j] == y:
-                        j += 1
-                        continue
-                    pygame.draw.line(screen, self.color, (self.x[x][y], -self.z[x][y]), (self.x[x][y-1], -self.z[x][y-1]), width=1)
-            for x in range(1, n):
-                if np.isnan(self.Z[x][0]) or np.isnan(self.Z[x-1][0]):
-                    continue
-                pygame.draw.line(screen, self.color, (self.x[x][0], -self.z[x][0]), (self.x[x-1][0], -self.z[x-1][0]), width=1)
-            for y in range(1, m):
-                if np.isnan(self.Z[0][y]) or np.isnan(self.Z[0][y-1]):
-                    continue
-                pygame.draw.line(screen, self.color, (self.x[0][y], -self.z[0][y]), (self.x[0][y-1], -self.z[0][y-1]), width=1)
+            with profiler.phase('points', chart_id):
+                draw_points(screen, self.color, points)
+        if self.show_lines and not self.show_faces:
+            with profiler.phase('segments', chart_id):
+                polylines = edge_polylines(points, self.level.edges, self.level.joined, *screen.get_size())
+            with profiler.phase('lines', chart_id):
+                draw_polylines(screen, self.color, *polylines)
+        elapsed = perf_counter() - start + (self.face_time if self.show_faces else 0)
+        node_cost = elapsed / self.level.size
+        self.node_cost += LOD_COST_SMOOTHING * (node_cost - self.node_cost)
+
+
+def distribute_frame_budget(charts, frame_time):
+    # Every chart gets a share of the frame proportional to its full detail cost
+    total_cost = sum(chart.estimated_cost() for chart in charts)
+    for chart in charts:
+        if frame_time is None or total_cost <= frame_time:
+            chart.set_frame_budget(None)
+        else:
+            chart.set_frame_budget(frame_time * chart.estimated_cost() / total_cost)
 
 
 def add_axis_charts(charts):
@@ -175,7 +228,80 @@ def add_axis_charts(charts):
     charts[-3] = z_axis_chart
 
 
+def create_chart(func, x_from, x_to, y_from, y_to, x_step, y_step, scale=1, params=None, **style):
+    chart = Chart()
+    chart.make_chart(compile_expression(normalize(func)).bind(params or {}),
+                     x_from, x_to, y_from, y_to, x_step, y_step, scale, **style)
+    return chart
+
+
+class FaceLayer:
+    # The screen as it was after the last filled charts were drawn on the
+    # background. While the same charts are filled and none of them changed, it
+    # is copied back instead of drawing their quads again.
+    def __init__(self):
+        self.key = None
+        self.surface = None
+
+    def draw(self, screen, filled, profiler=NO_PROFILER):
+        key = (screen, screen.get_size(), tuple(filled.values()))
+        if key == self.key and not any(chart.dirty for chart in filled.values()):
+            screen.blit(self.surface, (0, 0))
+            return
+        for chart_id, chart in filled.items():
+            with profiler.phase('project', chart_id):
+                chart.project()
+        render_faces(screen, list(filled.values()))
+        self.key, self.surface = key, screen.copy()
+
+
+face_layer = FaceLayer()
+
+
+def render_frame(screen, charts, profiler=NO_PROFILER):
+    # charts maps chart ids to charts
+    screen.fill(BG_COLOR)
+    filled = {chart_id: chart for chart_id, chart in charts.items() if chart.show_faces}
+    if filled:
+        with profiler.phase('faces'):
+            face_layer.draw(screen, filled, profiler)
+    for chart_id, chart in charts.items():
+        chart.render(screen, profiler, chart_id)
+
+
+def render_faces(screen, charts):
+    # Painter's algorithm over the quads of all filled charts together, so that
+    # surfaces hide each other as well as themselves: the farthest go first.
+    # Lines of a filled chart are the outlines of its quads.
+    if not charts:
+        return
+    start = perf_counter()
+    faces = [chart.faces() for chart in charts]
+    counts = [len(indices) for indices, _, _ in faces]
+    offsets = np.cumsum([0] + [chart.level.size for chart in charts[:-1]])
+    quads = np.concatenate([indices + offset for (indices, _, _), offset in zip(faces, offsets)])
+    depth = np.concatenate([depth for _, depth, _ in faces])
+    colors = np.concatenate([colors for _, _, colors in faces])
+    owners = np.repeat(np.arange(len(charts)), counts)
+    order = np.argsort(-depth, kind='stable')
+    points = np.concatenate([chart.points.reshape(-1, 2) for chart in charts])
+    line_colors = [chart.color if chart.show_lines else None for chart in charts]
+    draw_faces(screen, points, quads[order], colors[order], owners[order], line_colors)
+    elapsed = perf_counter() - start
+    for chart, count in zip(charts, counts):
+        chart.face_time = elapsed * count / max(sum(counts), 1)
+
+
+def init_headless(size=PLOTTER_WINDOW_SIZE):
+    # Offscreen rendering without a window, e.g. for benchmarks and CI
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pygame.init()
+    return pygame.Surface(size)
+
+
 def main():
+    from gui import start_gui
+
     pygame.init()
 
     charts = {}
@@ -188,28 +314,58 @@ def main():
     os.environ['SDL_VIDEO_WINDOW_POS'] = '{},{}'.format(*PLOTTER_WINDOW_POS)
     os.environ['SDL_VIDEO_CENTERED'] = '0'
     screen = pygame.display.set_mode(PLOTTER_WINDOW_SIZE, pygame.RESIZABLE)
-    mainloop(screen, charts, queue)
+    worker = MeshWorker(cache=MeshCache())
+    shared_arrays = SharedArrayReader()
+    mainloop(screen, charts, SignalQueue(queue), worker, shared_arrays)
 
+    worker.shutdown()
+    charts.clear()
+    shared_arrays.release_all()
     gui_process.kill()
     pygame.quit()
 
 
-def mainloop(screen, charts, queue):
+def mainloop(screen, charts, signals, worker, shared_arrays):
     width, height = screen.get_size()
     time = pygame.time.Clock()
     rotation = False
     moving = False
     last_mouse_pos, mouse_pos = None, None
     fps_font = pygame.font.Font(None, 50)
+    profiler = FrameProfiler()
+    profiler_font = pygame.font.Font(None, 24)
     x_bias = WIDTH // 2
     y_bias = 0
     z_bias = -HEIGHT // 2
     h_angle = START_H_ANGLE
     v_angle = START_V_ANGLE
     zoom = 1
+    params = {}
+    animations = {}
+    data_grids = {}
+    playing = False
+    frame = 0
+    play_start = play_frame = None
+    zoom_time = -LOD_ZOOM_HOLD
+    redraw = True
+    idle = False
+
+    def stop_animation(chart_id):
+        if chart_id in animations:
+            animations.pop(chart_id).close()
+
+    def get_chart(chart_id):
+        if chart_id not in charts:
+            charts[chart_id] = Chart()
+            charts[chart_id].move(x_bias, y_bias, z_bias)
+            charts[chart_id].rotate(h_angle, v_angle)
+            charts[chart_id].zoom(zoom)
+        return charts[chart_id]
 
     while True:
-        time.tick(FPS)
+        time.tick(IDLE_FPS if idle and not worker.has_jobs() and not (playing and animations) else FPS)
+        profiler.begin_frame()
+        events_start = perf_counter()
         for event in pygame.event.get():
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == LEFT_MOUSE_BUTTON:
@@ -219,10 +375,12 @@ def mainloop(screen, charts, queue):
                     moving = True
                     last_mouse_pos = event.pos
                 elif event.button == MOUSEWHEELUP:
+                    zoom_time = pygame.time.get_ticks()
                     zoom += ZOOM_CHANGE_SPEED
                     for chart in charts.values():
                         chart.zoom(zoom)
                 elif event.button == MOUSEWHEELDOWN:
+                    zoom_time = pygame.time.get_ticks()
                     if zoom - ZOOM_CHANGE_SPEED > 0:
                         zoom -= ZOOM_CHANGE_SPEED
                     for chart in charts.values():
@@ -261,42 +419,143 @@ def mainloop(screen, charts, queue):
                 for chart in charts.values():
                     chart.move(x_bias, 0, z_bias)
                 width, height = screen.get_size()
+                redraw = True
 
-            elif event.type == pygame.QUIT:
-                return
-
-        screen.fill(BG_COLOR)
-        for chart in charts.values():
-            chart.render(screen)
+            elif event.type == pygame.VIDEOEXPOSE:
+                redraw = True
 
-        fps = fps_font.render(str(int(time.get_fps())), True, 'green')
-        screen.blit(fps, (width - 50, 0))
+            elif event.type == pygame.KEYDOWN:
+                if pygame.key.name(event.key) == PROFILE_OVERLAY_KEY:
+                    profiler.enabled = not profiler.enabled
+                    redraw = True
+                elif pygame.key.name(event.key) == PROFILE_EXPORT_KEY and profiler.frames:
+                    profiler.export_csv(PROFILE_EXPORT_PATH + '.csv')
+                    profiler.export_trace(PROFILE_EXPORT_PATH + '.json')
+                    print("Profile saved:", PROFILE_EXPORT_PATH + '.csv', PROFILE_EXPORT_PATH + '.json')
 
-        pygame.display.flip()
+            elif event.type == pygame.QUIT:
+                for chart_id in list(animations):
+                    stop_animation(chart_id)
+                return
 
-        if not queue.empty():
-            signal = queue.get()
+        profiler.record('events', events_start)
+
+        meshes_start = perf_counter()
+        shared_arrays.collect()
+        for chart_id, mesh in worker.finished():
+            if chart_id in charts:
+                if isinstance(mesh, MappedGrid):
+                    # A data file opened by the worker, with the mesh of the part in view
+                    data_grids[chart_id], mesh = mesh, mesh.mesh
+                    data_grids[chart_id].mesh = None
+                if mesh is None:
+                    charts[chart_id].clear()
+                else:
+                    charts[chart_id].set_mesh(mesh)
+
+        if playing:
+            frame = play_frame + int((perf_counter() - play_start) * FPS)
+        for chart_id, animation in animations.items():
+            mesh = animation.take(frame)
+            if mesh is not None:
+                charts[chart_id].set_mesh(mesh)
+
+        zooming = pygame.time.get_ticks() - zoom_time < LOD_ZOOM_HOLD
+        interaction = rotation or moving or zooming
+        distribute_frame_budget(charts.values(), LOD_FRAME_TIME if interaction else None)
+        if not interaction:
+            # Data files are cut to the part on the screen once the view settles
+            for chart_id, grid in data_grids.items():
+                window = grid.visible_window(charts[chart_id].view_matrix(), width, height)
+                if window != grid.window:
+                    grid.window = window
+                    worker.submit_window(chart_id, grid, window)
+        profiler.add_jobs(worker.take_timings())
+        profiler.record('meshes', meshes_start)
+
+        idle = not (redraw or any(chart.dirty for chart in charts.values()))
+        if not idle:
+            with profiler.phase('render'):
+                render_frame(screen, charts, profiler)
+
+            fps = fps_font.render(str(int(time.get_fps())), True, 'green')
+            screen.blit(fps, (width - 50, 0))
+            if profiler.enabled:
+                profiler.draw_overlay(screen, profiler_font, signals)
+
+            with profiler.phase('flip'):
+                pygame.display.flip()
+            redraw = False
+
+        signals_start = perf_counter()
+        for signal in signals.drain():
             if signal[0] == Signals.show_chart:
                 chart_id = signal[1]
-                if chart_id not in charts:
-                    charts[chart_id] = Chart()
-                signal[2] = eval(signal[2])
-                charts[chart_id].make_chart(*signal[2:])
-                charts[chart_id].move(x_bias, y_bias, z_bias)
-                charts[chart_id].rotate(h_angle, v_angle)
-                charts[chart_id].zoom(zoom)
+                chart = get_chart(chart_id)
+                func, *mesh_params, color, show_points, show_lines, show_faces, adaptive = signal[2:]
+                chart.set_style(color, show_points, show_lines, show_faces)
+                stop_animation(chart_id)
+                data_grids.pop(chart_id, None)
+                shared_arrays.release(chart_id)
+                try:
+                    expression = compile_expression(func)
+                    if expression.animated:
+                        worker.cancel(chart_id)
+                        animations[chart_id] = FrameRing(expression.bind(params), *mesh_params, frame=frame)
+                    else:
+                        worker.submit(chart_id, expression.bind(params), *mesh_params, previous=chart.mesh,
+                                      adaptive=adaptive)
+                except Exception as err:
+                    worker.cancel(chart_id)
+                    chart.clear()
+                    print("Error:", err)
+            elif signal[0] == Signals.show_data:
+                chart_id, handle, color, show_points, show_lines, show_faces = signal[1:]
+                chart = get_chart(chart_id)
+                chart.set_style(color, show_points, show_lines, show_faces)
+                stop_animation(chart_id)
+                data_grids.pop(chart_id, None)
+                try:
+                    worker.submit_data(chart_id, shared_arrays.attach(chart_id, handle))
+                except FileNotFoundError as err:
+                    print("Error:", err)
+            elif signal[0] == Signals.show_file:
+                chart_id, path, row_length, dtype, color, show_points, show_lines, show_faces = signal[1:]
+                chart = get_chart(chart_id)
+                chart.set_style(color, show_points, show_lines, show_faces)
+                stop_animation(chart_id)
+                data_grids.pop(chart_id, None)
+                shared_arrays.release(chart_id)
+                worker.submit_file(chart_id, path, row_length, dtype, chart.view_matrix(), width, height)
+            elif signal[0] == Signals.set_style:
+                chart_id, color, show_points, show_lines, show_faces = signal[1:]
+                if chart_id in charts:
+                    charts[chart_id].set_style(color, show_points, show_lines, show_faces)
             elif signal[0] == Signals.del_chart:
                 chart_id = signal[1]
+                worker.cancel(chart_id)
+                stop_animation(chart_id)
+                data_grids.pop(chart_id, None)
                 if chart_id in charts:
                     del charts[chart_id]
+                    redraw = True
+                shared_arrays.release(chart_id)
             elif signal[0] == Signals.add_param:
                 param_name, param_value = signal[1:]
-                globals()[param_name] = param_value
+                params[param_name] = param_value
             elif signal[0] == Signals.del_param:
                 param_name = signal[1]
-                del globals()[param_name]
+                params.pop(param_name, None)
+            elif signal[0] == Signals.play:
+                playing = signal[1]
+                play_start, play_frame = perf_counter(), frame
             elif signal[0] == Signals.stop_execution:
+                for chart_id in list(animations):
+                    stop_animation(chart_id)
                 return
+        profiler.record('signals', signals_start)
+        if not idle:
+            profiler.end_frame()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,135 @@
+import csv
+import json
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+import pygame
+
+from config import PROFILE_FRAMES
+
+
+class FrameProfiler:
+    # Time spent in every phase of the last PROFILE_FRAMES frames, with the node and
+    # segment counts of every chart. Phases can nest and may belong to a chart; mesh
+    # jobs timed on the worker threads are kept apart, as they do not stall a frame.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.origin = perf_counter()
+        self.frames = deque(maxlen=PROFILE_FRAMES)
+        self.jobs = deque(maxlen=PROFILE_FRAMES)
+        self.frame = None
+        self.frame_count = 0
+
+    def begin_frame(self):
+        # Drops the previous frame unless it was ended
+        if self.enabled:
+            self.frame = {'number': self.frame_count, 'phases': [], 'counts': {}}
+
+    def end_frame(self):
+        if self.enabled and self.frame is not None:
+            self.frames.append(self.frame)
+            self.frame_count += 1
+            self.frame = None
+
+    def phase(self, name, chart_id=None):
+        if not self.enabled or self.frame is None:
+            return nullcontext()
+        return self._phase(name, chart_id)
+
+    @contextmanager
+    def _phase(self, name, chart_id):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, chart_id)
+
+    def record(self, name, start, chart_id=None):
+        # A phase that began at start, a perf_counter() value, and ends now
+        if self.enabled and self.frame is not None:
+            self.frame['phases'].append((name, chart_id, start - self.origin, perf_counter() - start))
+
+    def count(self, chart_id, nodes, segments):
+        if self.enabled and self.frame is not None:
+            self.frame['counts'][chart_id] = nodes, segments
+
+    def add_jobs(self, jobs):
+        if self.enabled:
+            self.jobs.extend((chart_id, start - self.origin, end - start) for chart_id, start, end in jobs)
+
+    def averages(self):
+        # Mean milliseconds a frame for every phase and for every chart
+        phases = {}
+        charts = {}
+        for frame in self.frames:
+            for name, chart_id, _, duration in frame['phases']:
+                phases[name] = phases.get(name, 0) + duration
+                if chart_id is not None:
+                    charts[chart_id] = charts.get(chart_id, 0) + duration
+        frames = max(len(self.frames), 1)
+        return ({name: total * 1000 / frames for name, total in phases.items()},
+                {chart_id: total * 1000 / frames for chart_id, total in charts.items()})
+
+    def draw_overlay(self, screen, font, signals=None):
+        # A table of mean phase and chart times over the kept frames, with the
+        # latest counts; the default font is not monospaced, so cells are measured
+        phases, charts = self.averages()
+        counts = self.frames[-1]['counts'] if self.frames else {}
+        rows = [(name, f'{ms:.2f} ms') for name, ms in phases.items()]
+        rows.append(())
+        rows += [(f'chart {chart_id}', f'{ms:.2f} ms', f'{counts.get(chart_id, (0, 0))[0]} nodes',
+                  f'{counts.get(chart_id, (0, 0))[1]} segments')
+                 for chart_id, ms in sorted(charts.items(), key=lambda item: -item[1])]
+        if signals is not None:
+            rows += [(), ('signals', f'{signals.received} received', f'{signals.dropped} dropped',
+                          f'{signals.depth} last drain')]
+        cells = [[font.render(cell, True, 'white') for cell in row] for row in rows]
+        columns = max(len(row) for row in cells)
+        widths = [max((row[column].get_width() for row in cells if len(row) > column), default=0) + 15
+                  for column in range(columns)]
+        line_height = font.get_linesize()
+        panel = pygame.Surface((sum(widths) + 20, line_height * len(cells) + 20), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 180))
+        for line, row in enumerate(cells):
+            x = 10
+            for column, cell in enumerate(row):
+                # Numbers are right aligned
+                shift = widths[column] - 15 - cell.get_width() if column else 0
+                panel.blit(cell, (x + shift, 10 + line * line_height))
+                x += widths[column]
+        screen.blit(panel, (0, 0))
+
+    def export_csv(self, path):
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(('frame', 'thread', 'phase', 'chart', 'start_ms', 'duration_ms', 'nodes', 'segments'))
+            for frame in self.frames:
+                for name, chart_id, start, duration in frame['phases']:
+                    nodes, segments = frame['counts'].get(chart_id, ('', ''))
+                    writer.writerow((frame['number'], 'main', name, '' if chart_id is None else chart_id,
+                                     f'{start * 1000:.3f}', f'{duration * 1000:.3f}', nodes, segments))
+            for chart_id, start, duration in self.jobs:
+                writer.writerow(('', 'worker', 'mesh', chart_id, f'{start * 1000:.3f}',
+                                 f'{duration * 1000:.3f}', '', ''))
+
+    def export_trace(self, path):
+        # Chrome trace event format, opens in chrome://tracing and Perfetto
+        events = []
+        for frame in self.frames:
+            for name, chart_id, start, duration in frame['phases']:
+                events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 'main',
+                               'ts': start * 1e6, 'dur': duration * 1e6,
+                               'args': {'frame': frame['number'], 'chart': chart_id}})
+            start = min((phase[2] for phase in frame['phases']), default=0)
+            for chart_id, (nodes, segments) in frame['counts'].items():
+                events.append({'name': f'chart {chart_id}', 'ph': 'C', 'pid': 0, 'ts': start * 1e6,
+                               'args': {'nodes': nodes, 'segments': segments}})
+        for chart_id, start, duration in self.jobs:
+            events.append({'name': 'mesh', 'ph': 'X', 'pid': 0, 'tid': 'worker',
+                           'ts': start * 1e6, 'dur': duration * 1e6, 'args': {'chart': chart_id}})
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+NO_PROFILER = FrameProfiler()
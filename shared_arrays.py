@@ -0,0 +1,70 @@
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+if os.name == 'posix':
+    from multiprocessing import resource_tracker
+
+
+class SharedArrayWriter:
+    # Owner side: copies arrays into shared memory segments, one set per chart,
+    # and unlinks them when the chart's data is replaced or deleted
+    def __init__(self):
+        self.segments = {}
+
+    def allocate(self, chart_id, shape, dtype=np.float64):
+        # Returns the handle to send and an array to fill in place
+        self.release(chart_id)
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.segments[chart_id] = segment
+        return (segment.name, tuple(shape), dtype.str), np.ndarray(shape, dtype, buffer=segment.buf)
+
+    def release(self, chart_id):
+        segment = self.segments.pop(chart_id, None)
+        if segment is not None:
+            segment.close()
+            segment.unlink()
+
+    def release_all(self):
+        for chart_id in list(self.segments):
+            self.release(chart_id)
+
+
+class SharedArrayReader:
+    # Reader side: maps published segments as NumPy arrays without copying them
+    def __init__(self):
+        self.segments = {}
+        self.closing = []
+
+    def attach(self, chart_id, handle):
+        self.release(chart_id)
+        name, shape, dtype = handle
+        segment = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':
+            # The writer owns the segment: this process must not unlink it on exit
+            resource_tracker.unregister(segment._name, 'shared_memory')
+        self.segments[chart_id] = segment
+        return np.ndarray(shape, dtype, buffer=segment.buf)
+
+    def release(self, chart_id):
+        segment = self.segments.pop(chart_id, None)
+        if segment is not None:
+            self.closing.append(segment)
+        self.collect()
+
+    def collect(self):
+        # A segment can only be closed once no array views into it are left
+        still_used = []
+        for segment in self.closing:
+            try:
+                segment.close()
+            except BufferError:
+                still_used.append(segment)
+        self.closing = still_used
+
+    def release_all(self):
+        for chart_id in list(self.segments):
+            self.release(chart_id)
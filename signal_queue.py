@@ -0,0 +1,49 @@
+from queue import Empty
+
+from config import Signals
+
+
+class SignalQueue:
+    def __init__(self, queue):
+        self.queue = queue
+        self.depth = 0
+        self.received = 0
+        self.dropped = 0
+
+    def drain(self):
+        signals = []
+        while True:
+            try:
+                signals.append(self.queue.get_nowait())
+            except Empty:
+                break
+        self.depth = len(signals)
+        self.received += len(signals)
+        signals_left = coalesce(signals)
+        self.dropped += len(signals) - len(signals_left)
+        return signals_left
+
+
+def coalesce(signals):
+    # Only the final state matters: the latest value of every parameter is applied
+    # first, then the latest show/del of every chart, so each chart is evaluated once,
+    # then the styles set since.
+    params = {}
+    playback = []
+    charts = {}
+    styles = {}
+    for signal in signals:
+        if signal[0] == Signals.stop_execution:
+            return [signal]
+        elif signal[0] in (Signals.add_param, Signals.del_param):
+            params.pop(signal[1], None)
+            params[signal[1]] = signal
+        elif signal[0] == Signals.play:
+            playback = [signal]
+        elif signal[0] in (Signals.show_chart, Signals.show_data, Signals.show_file, Signals.del_chart):
+            charts.pop(signal[1], None)
+            charts[signal[1]] = signal
+            styles.pop(signal[1], None)
+        elif signal[0] == Signals.set_style:
+            styles[signal[1]] = signal
+    return [*params.values(), *playback, *charts.values(), *styles.values()]